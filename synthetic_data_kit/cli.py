@@ -8,13 +8,14 @@
 import os
 import typer
 from pathlib import Path
-from typing import Optional
-import requests
+from typing import List, Optional
 from rich.console import Console
 from rich.table import Table
 
 from synthetic_data_kit.utils.config import load_config, get_vllm_config, get_path_config
 from synthetic_data_kit.core.context import AppContext
+from synthetic_data_kit.models.usage import UsageTracker
+from synthetic_data_kit.models.reasoning import ReasoningLog
 
 # Initialize Typer app
 app = typer.Typer(
@@ -27,6 +28,41 @@ console = Console()
 # Create app context
 ctx = AppContext()
 
+
+def print_usage(usage: UsageTracker, report_path: Optional[Path] = None):
+    """Print per-stage token usage and latency, and save the full report if asked"""
+    stages = usage.by_stage()
+    if stages:
+        table = Table(title="LLM usage by stage")
+        table.add_column("Stage")
+        for column in ("Reqs", "Cached", "Failed", "Prompt", "Output", "Think", "Latency", "p95", "TTFT", "Tok/s"):
+            table.add_column(column, justify="right")
+        
+        def fmt(value, suffix=""):
+            return "-" if value is None else f"{value:.2f}{suffix}"
+        
+        for stage, stats in sorted(stages.items()) + [("total", usage.total())]:
+            # Counts for streams cut off before their usage event are local estimates
+            approx = "~" if stats["estimated"] else ""
+            table.add_row(
+                stage,
+                str(stats["requests"]),
+                str(stats["cached"]),
+                str(stats["failed"]),
+                f"{approx}{stats['prompt_tokens']}",
+                f"{approx}{stats['completion_tokens']}",
+                str(stats["reasoning_tokens"]),
+                fmt(stats["mean_latency"], "s"),
+                fmt(stats["p95_latency"], "s"),
+                fmt(stats["mean_ttft"], "s"),
+                "-" if stats["tokens_per_second"] is None else f"{stats['tokens_per_second']:.0f}",
+            )
+        console.print(table)
+    if report_path:
+        usage.save(str(report_path))
+        console.print(f"Usage report saved to [bold]{report_path}[/bold]")
+
+
 # Define global options
 @app.callback()
 def callback(
@@ -56,18 +92,13 @@ def system_check(
     api_base = api_base or vllm_config.get("api_base")
     
     with console.status(f"Checking VLLM server at {api_base}..."):
-        try:
-            response = requests.get(f"{api_base}/models", timeout=2)
-            if response.status_code == 200:
-                console.print(f" VLLM server is running at {api_base}", style="green")
-                console.print(f"Available models: {response.json()}")
-                return 0
-            else:
-                console.print(f"L VLLM server is not available at {api_base}", style="red")
-                console.print(f"Error: Server returned status code: {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            console.print(f"L VLLM server is not available at {api_base}", style="red")
-            console.print(f"Error: {str(e)}")
+        available, info = ctx.check_server(api_base)
+        if available:
+            console.print(f" VLLM server is running at {api_base}", style="green")
+            console.print(f"Available models: {info}")
+            return 0
+        console.print(f"L VLLM server is not available at {api_base}", style="red")
+        console.print(f"Error: {info}")
             
         # Show instruction to start the server
         model = vllm_config.get("model")
@@ -108,7 +139,7 @@ def ingest(
 
 @app.command()
 def create(
-    input: str = typer.Argument(..., help="File to process"),
+    input: str = typer.Argument(..., help="File, directory or glob pattern of files to process"),
     content_type: str = typer.Option(
         "qa", "--type", help="Type of content to generate [qa|summary|cot|cot-enhance]"
     ),
@@ -116,7 +147,7 @@ def create(
         None, "--output-dir", "-o", help="Where to save the output"
     ),
     api_base: Optional[str] = typer.Option(
-        None, "--api-base", help="VLLM API base URL"
+        None, "--api-base", help="VLLM API base URL (comma-separate several to load balance)"
     ),
     model: Optional[str] = typer.Option(
         None, "--model", "-m", help="Model to use"
@@ -127,10 +158,34 @@ def create(
     verbose: bool = typer.Option(
         False, "--verbose", "-v", help="Show detailed output"
     ),
+    no_cache: bool = typer.Option(
+        False, "--no-cache", help="Don't read or write the LLM response cache"
+    ),
+    refresh_cache: bool = typer.Option(
+        False, "--refresh-cache", help="Ignore cached responses and overwrite them"
+    ),
+    batch_file: Optional[Path] = typer.Option(
+        None, "--batch-file", help="Write requests to an OpenAI batch-format JSONL instead of calling the server"
+    ),
+    ingest_results: Optional[List[Path]] = typer.Option(
+        None, "--ingest-results", help="Batch output JSONL to answer requests from (repeatable)"
+    ),
+    usage_report: Optional[Path] = typer.Option(
+        None, "--usage-report", help="Write per-stage token usage and latency to this JSON file"
+    ),
+    reasoning_log: Optional[Path] = typer.Option(
+        None, "--reasoning-log", help="Append the model's reasoning for each answer to this JSONL file"
+    ),
+    max_documents: Optional[int] = typer.Option(
+        None, "--max-documents", help="Documents processed at once when the input is a directory or glob"
+    ),
 ):
     """
     Generate content from text using local LLM inference.
     
+    A directory or glob input processes every matching file in one run,
+    sharing one in-flight request window across documents.
+    
     Content types:
     - qa: Generate question-answer pairs from text
     - summary: Generate a summary of the text
@@ -141,46 +196,99 @@ def create(
        - An array of conversation objects, each with a 'conversations' field
        - A direct array of conversation messages)
     """
-    from synthetic_data_kit.core.create import process_file
+    from synthetic_data_kit.core.create import process_file, process_files, find_input_files
+    from synthetic_data_kit.models.metrics import PrefixCacheMonitor
+    from synthetic_data_kit.models.endpoints import parse_api_bases
     
     # Get VLLM server details from args or config
     vllm_config = get_vllm_config(ctx.config)
     api_base = api_base or vllm_config.get("api_base")
     model = model or vllm_config.get("model")
     
-    # Check server first
-    try:
-        response = requests.get(f"{api_base}/models", timeout=2)
-        if response.status_code != 200:
+    # Offline batch runs don't need a live server
+    batch_job = ctx.get_batch_job(batch_file, ingest_results)
+    if batch_job is None:
+        available, _ = ctx.check_server(api_base)
+        if not available:
             console.print(f"L Error: VLLM server not available at {api_base}", style="red")
             console.print("Please start the VLLM server with:", style="yellow")
             console.print(f"vllm serve {model}", style="bold blue")
             return 1
-    except requests.exceptions.RequestException:
-        console.print(f"L Error: VLLM server not available at {api_base}", style="red")
-        console.print("Please start the VLLM server with:", style="yellow")
-        console.print(f"vllm serve {model}", style="bold blue")
-        return 1
     
     # Get output directory from args, then config, then default
     if output_dir is None:
         output_dir = get_path_config(ctx.config, "output", "generated")
     
+    cache = ctx.get_cache(no_cache=no_cache, refresh=refresh_cache)
+    usage = UsageTracker()
+    thoughts = ReasoningLog(str(reasoning_log)) if reasoning_log else None
+    
+    files = find_input_files(input, content_type)
+    if not files:
+        console.print(f"L Error: No input files found for {input}", style="red")
+        return 1
+    
+    # /metrics counters are server-wide, so measure the prefix cache over the whole run
+    prefix_monitor = None
+    if batch_job is None:
+        prefix_monitor = PrefixCacheMonitor(ctx.session, parse_api_bases(api_base))
+        prefix_monitor.start()
+    
     try:
-        with console.status(f"Generating {content_type} content from {input}..."):
-            output_path = process_file(
-                input,
-                output_dir,
-                ctx.config_path,
-                api_base,
-                model,
-                content_type,
-                num_pairs,
-                verbose
-            )
-        if output_path:
-            console.print(f" Content saved to [bold]{output_path}[/bold]", style="green")
-        return 0
+        errors = {}
+        if os.path.isfile(input):
+            with console.status(f"Generating {content_type} content from {input}..."):
+                output_path = process_file(
+                    input,
+                    output_dir,
+                    ctx.config_path,
+                    api_base,
+                    model,
+                    content_type,
+                    num_pairs,
+                    verbose,
+                    session=ctx.session,
+                    cache=cache,
+                    batch_job=batch_job,
+                    usage=usage,
+                    reasoning_log=thoughts
+                )
+            if output_path:
+                console.print(f" Content saved to [bold]{output_path}[/bold]", style="green")
+        else:
+            with console.status(f"Generating {content_type} content from {len(files)} files..."):
+                outputs, errors = process_files(
+                    files,
+                    output_dir,
+                    ctx.config_path,
+                    api_base,
+                    model,
+                    content_type,
+                    num_pairs,
+                    verbose,
+                    session=ctx.session,
+                    cache=cache,
+                    batch_job=batch_job,
+                    usage=usage,
+                    reasoning_log=thoughts,
+                    max_documents=max_documents
+                )
+            written = sum(1 for path in outputs.values() if path)
+            console.print(f" Content for {written} of {len(files)} files saved to [bold]{output_dir}[/bold]", style="green")
+            for path, error in errors.items():
+                console.print(f"L {path}: {error}", style="red")
+        if prefix_monitor is not None:
+            prefix_report = prefix_monitor.describe()
+            if prefix_report:
+                console.print(prefix_report)
+        if batch_job is not None:
+            console.print(batch_job.describe(model))
+        if cache.enabled:
+            console.print(cache.describe())
+        print_usage(usage, usage_report)
+        if thoughts is not None:
+            console.print(f"Saved reasoning for {thoughts.count} answers to [bold]{reasoning_log}[/bold]")
+        return 1 if errors else 0
     except Exception as e:
         console.print(f"L Error: {e}", style="red")
         return 1
@@ -196,7 +304,7 @@ def curate(
         None, "--threshold", "-t", help="Quality threshold (1-10)"
     ),
     api_base: Optional[str] = typer.Option(
-        None, "--api-base", help="VLLM API base URL"
+        None, "--api-base", help="VLLM API base URL (comma-separate several to load balance)"
     ),
     model: Optional[str] = typer.Option(
         None, "--model", "-m", help="Model to use"
@@ -204,6 +312,24 @@ def curate(
     verbose: bool = typer.Option(
         False, "--verbose", "-v", help="Show detailed output"
     ),
+    no_cache: bool = typer.Option(
+        False, "--no-cache", help="Don't read or write the LLM response cache"
+    ),
+    refresh_cache: bool = typer.Option(
+        False, "--refresh-cache", help="Ignore cached responses and overwrite them"
+    ),
+    batch_file: Optional[Path] = typer.Option(
+        None, "--batch-file", help="Write requests to an OpenAI batch-format JSONL instead of calling the server"
+    ),
+    ingest_results: Optional[List[Path]] = typer.Option(
+        None, "--ingest-results", help="Batch output JSONL to answer requests from (repeatable)"
+    ),
+    usage_report: Optional[Path] = typer.Option(
+        None, "--usage-report", help="Write per-stage token usage and latency to this JSON file"
+    ),
+    reasoning_log: Optional[Path] = typer.Option(
+        None, "--reasoning-log", help="Append the model's reasoning for each answer to this JSONL file"
+    ),
 ):
     """
     Clean and filter content based on quality.
@@ -215,19 +341,15 @@ def curate(
     api_base = api_base or vllm_config.get("api_base")
     model = model or vllm_config.get("model")
     
-    # Check server first
-    try:
-        response = requests.get(f"{api_base}/models", timeout=2)
-        if response.status_code != 200:
+    # Offline batch runs don't need a live server
+    batch_job = ctx.get_batch_job(batch_file, ingest_results)
+    if batch_job is None:
+        available, _ = ctx.check_server(api_base)
+        if not available:
             console.print(f"L Error: VLLM server not available at {api_base}", style="red")
             console.print("Please start the VLLM server with:", style="yellow")
             console.print(f"vllm serve {model}", style="bold blue")
             return 1
-    except requests.exceptions.RequestException:
-        console.print(f"L Error: VLLM server not available at {api_base}", style="red")
-        console.print("Please start the VLLM server with:", style="yellow")
-        console.print(f"vllm serve {model}", style="bold blue")
-        return 1
     
     # Get default output path from config if not provided
     if not output:
@@ -236,6 +358,10 @@ def curate(
         base_name = os.path.splitext(os.path.basename(input))[0]
         output = os.path.join(cleaned_dir, f"{base_name}_cleaned.json")
     
+    cache = ctx.get_cache(no_cache=no_cache, refresh=refresh_cache)
+    usage = UsageTracker()
+    thoughts = ReasoningLog(str(reasoning_log)) if reasoning_log else None
+    
     try:
         with console.status(f"Cleaning content from {input}..."):
             result_path = curate_qa_pairs(
@@ -245,9 +371,22 @@ def curate(
                 api_base,
                 model,
                 ctx.config_path,
-                verbose
+                verbose,
+                session=ctx.session,
+                cache=cache,
+                batch_job=batch_job,
+                usage=usage,
+                reasoning_log=thoughts
             )
-        console.print(f" Cleaned content saved to [bold]{result_path}[/bold]", style="green")
+        if result_path:
+            console.print(f" Cleaned content saved to [bold]{result_path}[/bold]", style="green")
+        if batch_job is not None:
+            console.print(batch_job.describe(model))
+        if cache.enabled:
+            console.print(cache.describe())
+        print_usage(usage, usage_report)
+        if thoughts is not None:
+            console.print(f"Saved reasoning for {thoughts.count} answers to [bold]{reasoning_log}[/bold]")
         return 0
     except Exception as e:
         console.print(f"L Error: {e}", style="red")
@@ -5,10 +5,15 @@
 # the root directory of this source tree.
 # Context Manager
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple, List, Union
 import os
+import requests
 
-from synthetic_data_kit.utils.config import DEFAULT_CONFIG_PATH
+from synthetic_data_kit.utils.config import DEFAULT_CONFIG_PATH, get_vllm_config
+from synthetic_data_kit.models.session import build_session, get_timeouts
+from synthetic_data_kit.models.cache import ResponseCache
+from synthetic_data_kit.models.endpoints import parse_api_bases
+from synthetic_data_kit.models.batch import BatchJob, load_batch_results
 
 class AppContext:
     """Context manager for global app state"""
@@ -17,9 +22,62 @@ class AppContext:
         """Initialize app context"""
         self.config_path = config_path or DEFAULT_CONFIG_PATH
         self.config: Dict[str, Any] = {}
+        self._session: Optional[requests.Session] = None
+        self._server_status: Dict[str, Tuple[bool, Any]] = {}
+        self._cache: Optional[ResponseCache] = None
         
         # Ensure data directories exist
         self._ensure_data_dirs()
+    
+    @property
+    def session(self) -> requests.Session:
+        """HTTP connection pool shared by every LLM client in this run"""
+        if self._session is None:
+            self._session = build_session(get_vllm_config(self.config))
+        return self._session
+    
+    def get_cache(self, no_cache: bool = False, refresh: bool = False) -> ResponseCache:
+        """LLM response cache shared by every client in this run"""
+        if self._cache is None:
+            self._cache = ResponseCache.from_config(
+                self.config,
+                enabled=False if no_cache else None,
+                refresh=refresh
+            )
+        return self._cache
+    
+    def get_batch_job(self,
+                      batch_file: Optional[Path] = None,
+                      ingest_results: Optional[List[Path]] = None) -> Optional[BatchJob]:
+        """Offline batch job for --batch-file/--ingest-results, or None for a live run"""
+        if batch_file is None and not ingest_results:
+            return None
+        results = load_batch_results(ingest_results) if ingest_results else None
+        return BatchJob(batch_file, results)
+    
+    def check_server(self, api_base: Union[str, List[str]]) -> Tuple[bool, Any]:
+        """Check VLLM server(s) once per run and remember the result
+        
+        With several endpoints the check passes if any of them is up.
+        """
+        results = {url: self._check_endpoint(url) for url in parse_api_bases(api_base)}
+        if len(results) == 1:
+            return next(iter(results.values()))
+        available = any(ok for ok, _ in results.values())
+        return available, {url: info for url, (_, info) in results.items()}
+    
+    def _check_endpoint(self, api_base: str) -> Tuple[bool, Any]:
+        if api_base not in self._server_status:
+            timeout = get_timeouts(get_vllm_config(self.config))[0]
+            try:
+                response = self.session.get(f"{api_base}/models", timeout=timeout)
+                if response.status_code == 200:
+                    self._server_status[api_base] = (True, response.json())
+                else:
+                    return False, f"Server returned status code: {response.status_code}"
+            except requests.exceptions.RequestException as e:
+                return False, str(e)
+        return self._server_status[api_base]
         
     # Why have separeate folders? Yes ideally you should just be able to ingest an input folder and have everything being ingested and converted BUT
     # Managing context window is hard and there are more edge cases which needs to be handled carefully
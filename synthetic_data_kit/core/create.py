@@ -6,12 +6,27 @@
 # Generate the content: CoT/QA/Summary Datasets
 import os
 import json
+import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, Dict, Any
+import requests
+from typing import Optional, Dict, Any, List, Tuple
 
 from synthetic_data_kit.models.llm_client import LLMClient
+from synthetic_data_kit.models.cache import ResponseCache
+from synthetic_data_kit.models.batch import BatchJob
+from synthetic_data_kit.models.usage import UsageTracker
+from synthetic_data_kit.models.reasoning import ReasoningLog
+from synthetic_data_kit.models.concurrency import AdaptiveLimiter
+from synthetic_data_kit.models.errors import BatchPendingError, CircuitOpenError
 from synthetic_data_kit.generators.qa_generator import QAGenerator
-from synthetic_data_kit.utils.config import get_generation_config
+from synthetic_data_kit.utils.config import load_config, get_vllm_config, get_generation_config
+from synthetic_data_kit.utils.minhash import NearDuplicateIndex
+
+
+def _batch_pending(client: LLMClient) -> bool:
+    """True when this document deferred requests to a batch file, so its output would be incomplete"""
+    return client.batch is not None and client.batch.pending_for(client.document) > 0
 
 def process_file(
     file_path: str,
@@ -22,7 +37,15 @@ def process_file(
     content_type: str = "qa",
     num_pairs: Optional[int] = None,
     verbose: bool = False,
-) -> str:
+    session: Optional[requests.Session] = None,
+    cache: Optional[ResponseCache] = None,
+    batch_job: Optional[BatchJob] = None,
+    usage: Optional[UsageTracker] = None,
+    reasoning_log: Optional[ReasoningLog] = None,
+    limiter: Optional[AdaptiveLimiter] = None,
+    pair_index: Optional[NearDuplicateIndex] = None,
+    name: Optional[str] = None,
+) -> Optional[str]:
     """Process a file to generate content
     
     Args:
@@ -34,9 +57,18 @@ def process_file(
         content_type: Type of content to generate (qa, summary, cot)
         num_pairs: Target number of QA pairs to generate
         threshold: Quality threshold for filtering (1-10)
+        session: Shared HTTP session from AppContext (the server is assumed already checked)
+        cache: LLM response cache (if None, built from config)
+        batch_job: Offline batch job; requests without an ingested result are
+            written to its batch file instead of being sent
+        usage: Usage tracker shared across the run (if None, the client keeps its own)
+        reasoning_log: Log that receives the model's reasoning for each answer
+        limiter: In-flight window shared with other documents processed at the same time
+        pair_index: Near-duplicate QA pair index shared with other documents (if None, one per document)
+        name: Name for the output file and usage tag (default: the file name without extension)
     
     Returns:
-        Path to the output file
+        Path to the output file, or None if requests were deferred to the batch file
     """
     # Create output directory if it doesn't exist
     # The reason for having this directory logic for now is explained in context.py
@@ -50,15 +82,43 @@ def process_file(
     client = LLMClient(
         config_path=config_path,
         api_base=api_base,
-        model_name=model
+        model_name=model,
+        session=session,
+        check_server=session is None,
+        cache=cache,
+        batch=batch_job,
+        usage=usage,
+        reasoning_log=reasoning_log,
+        limiter=limiter,
+        document=name or os.path.splitext(os.path.basename(file_path))[0]
     )
-    
+    try:
+        return _generate_content(
+            client, file_path, document_text, output_dir, config_path, content_type, num_pairs, verbose,
+            pair_index
+        )
+    finally:
+        client.close()
+
+
+def _generate_content(
+    client: LLMClient,
+    file_path: str,
+    document_text: str,
+    output_dir: str,
+    config_path: Optional[Path],
+    content_type: str,
+    num_pairs: Optional[int],
+    verbose: bool,
+    pair_index: Optional[NearDuplicateIndex] = None,
+) -> Optional[str]:
+    """Generate and save one document's content with a ready client; see process_file"""
     # Generate base filename for output
-    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    base_name = client.document
     
     # Generate content based on type
     if content_type == "qa":
-        generator = QAGenerator(client, config_path)
+        generator = QAGenerator(client, config_path, pair_index=pair_index)
         
         # Get num_pairs from args or config
         if num_pairs is None:
@@ -67,11 +127,16 @@ def process_file(
             num_pairs = generation_config.get("num_pairs", 25)
         
         # Process document
-        result = generator.process_document(
-            document_text,
-            num_pairs=num_pairs,
-            verbose=verbose
-        )
+        try:
+            result = generator.process_document(
+                document_text,
+                num_pairs=num_pairs,
+                verbose=verbose
+            )
+        except BatchPendingError:
+            result = None
+        if _batch_pending(client):
+            return None
         
         # Save output
         output_path = os.path.join(output_dir, f"{base_name}_qa_pairs.json")
@@ -91,6 +156,9 @@ def process_file(
             with open(output_path, 'w', encoding='utf-8') as f:
                 json.dump(result, f, indent=2)
             print(f"Successfully wrote result to {output_path}")
+            # The output now holds everything the checkpoint did
+            if generator.checkpoint is not None:
+                generator.checkpoint.remove()
         except Exception as e:
             print(f"Error writing result file: {e}")
         
@@ -100,7 +168,10 @@ def process_file(
         generator = QAGenerator(client, config_path)
         
         # Generate just the summary
-        summary = generator.generate_summary(document_text)
+        try:
+            summary = generator.generate_summary(document_text)
+        except BatchPendingError:
+            return None
         
         # Save output
         output_path = os.path.join(output_dir, f"{base_name}_summary.json")
@@ -126,11 +197,16 @@ def process_file(
             num_pairs = generation_config.get("num_pairs", 5)
         
         # Process document to generate CoT examples
-        result = generator.process_document(
-            document_text,
-            num_examples=num_pairs,
-            include_simple_steps=verbose  # More detailed if verbose is enabled
-        )
+        try:
+            result = generator.process_document(
+                document_text,
+                num_examples=num_pairs,
+                include_simple_steps=verbose  # More detailed if verbose is enabled
+            )
+        except BatchPendingError:
+            result = None
+        if _batch_pending(client):
+            return None
         
         # Save output
         output_path = os.path.join(output_dir, f"{base_name}_cot_examples.json")
@@ -196,7 +272,11 @@ def process_file(
                         continue
                     
                     # Enhance this conversation's messages
-                    enhanced_messages = generator.enhance_with_cot(conv_messages, include_simple_steps=verbose)
+                    try:
+                        enhanced_messages = generator.enhance_with_cot(conv_messages, include_simple_steps=verbose)
+                    except BatchPendingError:
+                        enhanced_conversations.append(conversation)
+                        continue
                     
                     # Create enhanced conversation with same structure
                     enhanced_conv = conversation.copy()
@@ -206,6 +286,9 @@ def process_file(
                     # Not the expected format, just keep original
                     enhanced_conversations.append(conversation)
             
+            if _batch_pending(client):
+                return None
+            
             # Save enhanced conversations
             output_path = os.path.join(output_dir, f"{base_name}_enhanced.json")
             
@@ -227,3 +310,137 @@ def process_file(
     
     else:
         raise ValueError(f"Unknown content type: {content_type}")
+
+
+def find_input_files(input_path: str, content_type: str = "qa") -> List[str]:
+    """Expand a create input into the files to process
+    
+    Args:
+        input_path: A file, a directory (its .txt files, or .json files for
+            cot-enhance) or a glob pattern
+        content_type: Type of content to generate
+    
+    Returns:
+        Sorted file paths
+    """
+    if os.path.isdir(input_path):
+        extension = ".json" if content_type == "cot-enhance" else ".txt"
+        return sorted(
+            os.path.join(input_path, name) for name in os.listdir(input_path)
+            if name.endswith(extension) and os.path.isfile(os.path.join(input_path, name))
+        )
+    if glob.has_magic(input_path):
+        return sorted(path for path in glob.glob(input_path, recursive=True) if os.path.isfile(path))
+    return [input_path] if os.path.isfile(input_path) else []
+
+
+def document_names(file_paths: List[str]) -> Dict[str, str]:
+    """Output name for each input file: its name without extension, made unique if needed
+    
+    Files that share a name (report.txt in two folders of a recursive glob)
+    are named by their path below the folders' common parent instead, e.g.
+    2021_report and 2022_report.
+    
+    Raises:
+        ValueError: If two files would still write the same output
+    """
+    stems = {path: os.path.splitext(os.path.basename(path))[0] for path in file_paths}
+    counts: Dict[str, int] = {}
+    for stem in stems.values():
+        counts[stem] = counts.get(stem, 0) + 1
+    clashing = [path for path, stem in stems.items() if counts[stem] > 1]
+    names = dict(stems)
+    if clashing:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in clashing])
+        for path in clashing:
+            relative = os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0]
+            names[path] = relative.replace(os.sep, "_")
+    
+    owners: Dict[str, str] = {}
+    for path, name in names.items():
+        if name in owners:
+            raise ValueError(f"{owners[name]} and {path} would both be written as {name}; rename one of them")
+        owners[name] = path
+    return names
+
+
+def process_files(
+    file_paths: List[str],
+    output_dir: str,
+    config_path: Optional[Path] = None,
+    api_base: Optional[str] = None,
+    model: Optional[str] = None,
+    content_type: str = "qa",
+    num_pairs: Optional[int] = None,
+    verbose: bool = False,
+    session: Optional[requests.Session] = None,
+    cache: Optional[ResponseCache] = None,
+    batch_job: Optional[BatchJob] = None,
+    usage: Optional[UsageTracker] = None,
+    reasoning_log: Optional[ReasoningLog] = None,
+    max_documents: Optional[int] = None,
+) -> Tuple[Dict[str, Optional[str]], Dict[str, str]]:
+    """Process many documents against one shared in-flight window
+    
+    Up to max_documents documents run at once and every request they make
+    waits for a slot in a single limiter (adaptive if configured, otherwise
+    fixed at vllm.max_in_flight), so the server is kept full across
+    document boundaries without being overloaded. Each document's output
+    is written as soon as that document finishes, under the name from
+    document_names. With generation.near_duplicate_scope set to "corpus",
+    QA pairs that nearly repeat one from any other document are dropped
+    as well.
+    
+    Args:
+        file_paths: Documents to process
+        max_documents: Documents in progress at once (default generation.max_documents)
+        Other arguments as for process_file
+    
+    Returns:
+        Output path per document (None if deferred to the batch file), and
+        the error message per document that failed
+    
+    Raises:
+        CircuitOpenError: If the server goes down, after cancelling documents not yet started
+        ValueError: If two documents would be written under the same name
+    """
+    names = document_names(file_paths)
+    config = load_config(config_path)
+    vllm_config = get_vllm_config(config)
+    limiter = AdaptiveLimiter.from_config(vllm_config) or AdaptiveLimiter.fixed(vllm_config.get('max_in_flight', 32))
+    generation_config = get_generation_config(config)
+    if max_documents is None:
+        max_documents = generation_config.get("max_documents", 8)
+    pair_index = None
+    if generation_config.get("near_duplicate_scope", "document") == "corpus":
+        pair_index = NearDuplicateIndex.from_config(generation_config)
+    
+    outputs: Dict[str, Optional[str]] = {}
+    errors: Dict[str, str] = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_documents, len(file_paths))))
+    futures = {
+        executor.submit(
+            process_file, path, output_dir, config_path, api_base, model, content_type, num_pairs, verbose,
+            session=session, cache=cache, batch_job=batch_job, usage=usage,
+            reasoning_log=reasoning_log, limiter=limiter, pair_index=pair_index, name=names[path]
+        ): path
+        for path in file_paths
+    }
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                outputs[path] = future.result()
+                status = outputs[path] or "deferred to batch file"
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                errors[path] = str(e)
+                status = f"failed: {e}"
+            print(f"[{done}/{len(file_paths)}] {path} -> {status}")
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+    return outputs, errors
+
@@ -8,11 +8,19 @@
 import os
 import json
 from pathlib import Path
+import requests
 from typing import Optional, Dict, Any, List
 
 from synthetic_data_kit.models.llm_client import LLMClient
+from synthetic_data_kit.models.cache import ResponseCache
+from synthetic_data_kit.models.batch import BatchJob
+from synthetic_data_kit.models.usage import UsageTracker
+from synthetic_data_kit.models.reasoning import ReasoningLog
+from synthetic_data_kit.models.errors import CompletionError, BatchPendingError, CircuitOpenError
 from synthetic_data_kit.generators.qa_generator import QAGenerator
-from synthetic_data_kit.utils.config import get_curate_config, get_prompt
+from synthetic_data_kit.utils.schemas import ratings_schema
+from synthetic_data_kit.utils.config import get_curate_config, get_generation_config, get_prompt, build_prompt_messages
+from synthetic_data_kit.utils.tokens import echo_max_tokens
 from synthetic_data_kit.utils.llm_processing import convert_to_conversation_format, parse_ratings
 
 def curate_qa_pairs(
@@ -23,7 +31,12 @@ def curate_qa_pairs(
     model: Optional[str] = None,
     config_path: Optional[Path] = None,
     verbose: bool = False,
-) -> str:
+    session: Optional[requests.Session] = None,
+    cache: Optional[ResponseCache] = None,
+    batch_job: Optional[BatchJob] = None,
+    usage: Optional[UsageTracker] = None,
+    reasoning_log: Optional[ReasoningLog] = None,
+) -> Optional[str]:
     """Clean and filter QA pairs based on quality ratings
     
     Args:
@@ -34,9 +47,15 @@ def curate_qa_pairs(
         model: Model to use
         config_path: Path to configuration file
         verbose: Show detailed output
+        session: Shared HTTP session from AppContext (the server is assumed already checked)
+        cache: LLM response cache (if None, built from config)
+        batch_job: Offline batch job; requests without an ingested result are
+            written to its batch file instead of being sent
+        usage: Usage tracker shared across the run (if None, the client keeps its own)
+        reasoning_log: Log that receives the model's reasoning for each answer
     
     Returns:
-        Path to the cleaned output file
+        Path to the cleaned output file, or None if requests were deferred to the batch file
     """
     # Set verbose either via CLI or via env variable. If its via CLI, set it to env variable
     if verbose:
@@ -60,8 +79,17 @@ def curate_qa_pairs(
     client = LLMClient(
         config_path=config_path,
         api_base=api_base,
-        model_name=model
+        model_name=model,
+        session=session,
+        check_server=session is None,
+        cache=cache,
+        batch=batch_job,
+        usage=usage,
+        reasoning_log=reasoning_log,
+        document=os.path.splitext(os.path.basename(input_path))[0]
     )
+    # Ratings may run on a smaller model configured in the curate profile
+    client = client.for_stage("curate")
     
     # Get threshold from args, then config, then default
     if threshold is None:
@@ -69,6 +97,10 @@ def curate_qa_pairs(
         cleanup_config = get_curate_config(config)
         threshold = cleanup_config.get("threshold", 7.0)
     
+    # Measure how much of the prompt work VLLM served from its prefix cache
+    prefix_monitor = client.prefix_cache_monitor()
+    prefix_monitor.start()
+    
     # Create QA generator
     generator = QAGenerator(client, config_path)
     
@@ -87,6 +119,8 @@ def curate_qa_pairs(
         inference_batch = curate_config.get("inference_batch", 32)
         
     rating_temperature = curate_config.get("temperature", 0.1)
+    # Rating replies restate the pairs, so they never need the full generation budget
+    max_tokens = get_generation_config(client.config).get("max_tokens", 4096)
     
     if threshold is None:
         threshold = curate_config.get("threshold", 7.0)
@@ -104,8 +138,7 @@ def curate_qa_pairs(
     all_messages = []
     for batch in batches:
         batch_json = json.dumps(batch, indent=2)
-        rating_prompt = rating_prompt_template.format(pairs=batch_json)
-        messages = [{"role": "system", "content": rating_prompt}]
+        messages = build_prompt_messages(rating_prompt_template, "pairs", pairs=batch_json)
         all_messages.append(messages)
     
     # Initialize counters and result containers
@@ -137,14 +170,12 @@ def curate_qa_pairs(
         progress_ctx = None
         rate_task = None
     
-    # Process in inference batches
-    for batch_start in range(0, len(all_messages), inference_batch):
-        batch_end = min(batch_start + inference_batch, len(all_messages))
-        current_batch = all_messages[batch_start:batch_end]
+    # Process in inference waves packed by estimated tokens, at most inference_batch requests each
+    waves = client.plan_waves(all_messages, max_requests=inference_batch)
+    for batch_num, wave in enumerate(waves, start=1):
+        current_batch = [all_messages[i] for i in wave]
         current_batch_size = len(current_batch)
-        
-        batch_num = batch_start//inference_batch + 1
-        total_batches = (len(all_messages) + inference_batch - 1)//inference_batch
+        total_batches = len(waves)
         
         # Simple progress indicator for non-verbose mode
         if not verbose:
@@ -157,20 +188,32 @@ def curate_qa_pairs(
             if verbose:
                 print(f"Sending batch request with {len(current_batch)} items")
                 
-            batch_responses = client.batch_completion(
-                current_batch,
+            # Batches differ in size, so the schema fixes the shape but not the count
+            options = dict(
                 temperature=rating_temperature,
-                batch_size=inference_batch
+                max_tokens=echo_max_tokens(client.tokens, current_batch, max_tokens),
+                batch_size=inference_batch,
+                expect_array=True,
+                json_schema=ratings_schema()
             )
+            with client.usage.scope("rating"):
+                batch_responses = client.batch_completion(current_batch, return_errors=True, **options)
+                # Only the batches whose requests failed are sent again
+                batch_responses = client.retry_failed(current_batch, batch_responses, **options)
             
             if verbose:
                 print(f"Received {len(batch_responses)} responses")
                 for i, resp in enumerate(batch_responses):
-                    print(f"Response {i+1}: {resp[:100]}...")
+                    print(f"Response {i+1}: {str(resp)[:100]}...")
             
             # Process each response
-            for j, response in enumerate(batch_responses):
-                original_batch_index = batch_start + j
+            for original_batch_index, response in zip(wave, batch_responses):
+                if isinstance(response, BatchPendingError):
+                    continue
+                if isinstance(response, CompletionError):
+                    if verbose:
+                        print(f"Skipping batch {original_batch_index+1}: {response.message}")
+                    continue
                 if original_batch_index < len(batches):
                     original_batch = batches[original_batch_index]
                     
@@ -203,11 +246,20 @@ def curate_qa_pairs(
                             
                             for item in original_batch:
                                 item_json = json.dumps(item, indent=2)
-                                rating_prompt = rating_prompt_template.format(pairs=item_json)
-                                item_response = client.chat_completion(
-                                    [{"role": "system", "content": rating_prompt}],
-                                    temperature=rating_temperature
-                                )
+                                item_messages = build_prompt_messages(rating_prompt_template, "pairs", pairs=item_json)
+                                try:
+                                    with client.usage.scope("rating_fallback"):
+                                        item_response = client.chat_completion(
+                                            item_messages,
+                                            temperature=rating_temperature,
+                                            max_tokens=echo_max_tokens(client.tokens, [item_messages], max_tokens),
+                                            expect_array=True,
+                                            max_items=1,
+                                            json_schema=ratings_schema(1)
+                                        )
+                                except BatchPendingError:
+                                    # Written to the batch file; keep going so every item lands in this pass
+                                    continue
                                 try:
                                     # This should be a single item
                                     rated_item = parse_ratings(item_response, [item])
@@ -226,6 +278,8 @@ def curate_qa_pairs(
                                 except Exception as inner_e:
                                     if verbose:
                                         print(f"Failed to process individual item: {str(inner_e)}")
+                        except CircuitOpenError:
+                            raise
                         except Exception as fallback_e:
                             if verbose:
                                 print(f"Fallback processing failed: {str(fallback_e)}")
@@ -237,6 +291,9 @@ def curate_qa_pairs(
             if progress_ctx and rate_task:
                 progress_ctx.update(rate_task, advance=current_batch_size)
             
+        except CircuitOpenError:
+            # The server is down; stop instead of failing every remaining batch
+            raise
         except Exception as e:
             if verbose:
                 print(f"Error processing inference batch {batch_num}: {str(e)}")
@@ -254,6 +311,9 @@ def curate_qa_pairs(
         print(" " * 80, end="\r")
         print("Batch processing complete.")
     
+    if batch_job is not None and batch_job.pending:
+        return None
+    
     # Calculate metrics
     metrics = {
         "total": len(qa_pairs),
@@ -266,6 +326,13 @@ def curate_qa_pairs(
     print(f"Rated {total_evaluated} QA pairs")
     print(f"Retained {total_passed} pairs (threshold: {threshold})")
     print(f"Average score: {metrics['avg_score']}")
+    if client.dedup and client.dedup.coalesced:
+        print(f"Coalesced {client.dedup.coalesced} duplicate rating requests into existing calls")
+    if client.hedger and client.hedger.issued:
+        print(client.hedger.describe())
+    prefix_report = prefix_monitor.describe()
+    if prefix_report:
+        print(prefix_report)
     
     # Convert to conversation format
     conversations = convert_to_conversation_format(filtered_pairs)
@@ -11,7 +11,9 @@ from typing import Dict, List, Any, Optional
 from pathlib import Path
 
 from synthetic_data_kit.models.llm_client import LLMClient
-from synthetic_data_kit.utils.config import get_prompt, get_generation_config
+from synthetic_data_kit.generators.summary_generator import SummaryGenerator
+from synthetic_data_kit.utils.schemas import cot_examples_schema
+from synthetic_data_kit.utils.config import get_prompt, get_generation_config, build_prompt_messages
 
 class COTGenerator:
     """Generates chain-of-thought reasoning examples"""
@@ -59,8 +61,10 @@ class COTGenerator:
         # Get the prompt template
         prompt_template = get_prompt(self.config, "cot_generation")
         
-        # Format the prompt
-        prompt = prompt_template.format(
+        # Format the prompt with the instructions ahead of the document text
+        messages = build_prompt_messages(
+            prompt_template,
+            "text",
             num_examples=num_examples,
             text=document_text
         )
@@ -72,12 +76,15 @@ class COTGenerator:
         if verbose:
             print(f"Generating {num_examples} CoT examples...")
         
-        messages = [{"role": "system", "content": prompt}]
-        response = self.client.chat_completion(
-            messages, 
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        with self.client.usage.scope("cot"):
+            response = self.client.for_stage("cot").chat_completion(
+                messages, 
+                temperature=temperature,
+                max_tokens=max_tokens,
+                expect_array=True,
+                max_items=num_examples,
+                json_schema=cot_examples_schema(num_examples)
+            )
         
         # Parse response
         examples = self.parse_json_output(response)
@@ -101,7 +108,9 @@ class COTGenerator:
         
         # Format the prompt
         conversation_str = json.dumps(conversations, ensure_ascii=False, indent=2)
-        prompt = prompt_template.format(
+        messages = build_prompt_messages(
+            prompt_template,
+            "conversations",
             conversations=conversation_str,
             include_simple_steps=str(include_simple_steps).lower()
         )
@@ -113,12 +122,13 @@ class COTGenerator:
         if verbose:
             print(f"Enhancing {len(conversations)} conversations with CoT...")
         
-        messages = [{"role": "system", "content": prompt}]
-        response = self.client.chat_completion(
-            messages, 
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        with self.client.usage.scope("cot_enhance"):
+            response = self.client.for_stage("cot").chat_completion(
+                messages, 
+                temperature=temperature,
+                max_tokens=max_tokens,
+                expect_array=True
+            )
         
         # Parse response
         enhanced_conversations = self.parse_json_output(response)
@@ -144,10 +154,8 @@ class COTGenerator:
             os.environ['SDK_VERBOSE'] = 'false'
         
         # Generate summary first (helpful context)
-        summary = self.client.chat_completion(
-            [{"role": "system", "content": "Summarize this document in 2-3 sentences."},
-             {"role": "user", "content": document_text}], 
-            temperature=0.1
+        summary = SummaryGenerator(self.client).summarize(
+            document_text, "Summarize this document in 2-3 sentences."
         )
         
         # Generate CoT examples
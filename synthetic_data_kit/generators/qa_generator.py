@@ -7,21 +7,35 @@
 
 from typing import Dict, List, Any, Optional, Tuple
 import json
+import math
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from rich.progress import Progress, BarColumn, TextColumn, TimeElapsedColumn, TimeRemainingColumn
 
 from synthetic_data_kit.models.llm_client import LLMClient
+from synthetic_data_kit.models.errors import CompletionError, BatchPendingError, CircuitOpenError
+from synthetic_data_kit.generators.summary_generator import SummaryGenerator
 from synthetic_data_kit.utils.text import split_into_chunks
+from synthetic_data_kit.utils.tokens import echo_max_tokens
+from synthetic_data_kit.utils.checkpoint import ChunkCheckpoint, request_key
+from synthetic_data_kit.utils.minhash import NearDuplicateIndex
 from synthetic_data_kit.utils.llm_processing import parse_qa_pairs, parse_ratings, convert_to_conversation_format
-from synthetic_data_kit.utils.config import load_config, get_generation_config, get_curate_config, get_prompt
+from synthetic_data_kit.utils.schemas import qa_pairs_schema, ratings_schema
+from synthetic_data_kit.utils.config import load_config, get_generation_config, get_curate_config, get_prompt, build_prompt_messages, prompt_fields
 
 class QAGenerator:
     def __init__(self, 
                  client: LLMClient,
-                 config_path: Optional[Path] = None):
-        """Initialize the QA Generator with an LLM client and optional config"""
+                 config_path: Optional[Path] = None,
+                 pair_index: Optional[NearDuplicateIndex] = None):
+        """Initialize the QA Generator with an LLM client and optional config
+        
+        pair_index is shared by every document of a corpus run so a QA
+        pair is dropped if it nearly repeats one from another document;
+        without it each document gets its own index.
+        """
         self.client = client
         
         # Load config
@@ -30,6 +44,10 @@ class QAGenerator:
         # Get specific configurations
         self.generation_config = get_generation_config(self.config)
         self.curate_config = get_curate_config(self.config)
+        
+        # Checkpoint of the last document passed to generate_qa_pairs
+        self.checkpoint: Optional[ChunkCheckpoint] = None
+        self.pair_index = pair_index
     
     def generate_summary(self, document_text: str) -> str:
         """Generate a summary of the document"""
@@ -37,28 +55,50 @@ class QAGenerator:
         if verbose:
             print("Generating document summary...")
         
-        # Get summary prompt from config
-        prompt = get_prompt(self.config, "summary")
-        
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": document_text}
-        ]
-        
-        summary = self.client.chat_completion(
-            messages, 
-            temperature=0.1  # Use lower temperature for summaries
-        )
+        # Long documents are summarized chunk by chunk and the partial summaries combined
+        summary = SummaryGenerator(self.client).summarize(document_text, get_prompt(self.config, "summary"))
         
         if verbose:
             print(f"Summary generated ({len(summary)} chars)")
         return summary
     
+    def generate_context_summary(self, document_text: str) -> str:
+        """Write a short summary from the first chunks only, as context for QA prompts
+        
+        QA prompts only use the start of the summary, so this reads
+        context_summary_chunks chunks and stops at context_summary_tokens,
+        which keeps it to one short round trip before generation starts.
+        """
+        chunks = split_into_chunks(
+            document_text,
+            chunk_size=self.generation_config.get("chunk_size", 4000),
+            overlap=self.generation_config.get("overlap", 200)
+        )
+        messages = [
+            {"role": "system", "content": get_prompt(self.config, "summary")},
+            {"role": "user", "content": "\n\n".join(chunks[:self.generation_config.get("context_summary_chunks", 2)])}
+        ]
+        with self.client.usage.scope("context_summary"):
+            return self.client.for_stage("summary").chat_completion(
+                messages,
+                temperature=0.1,
+                max_tokens=self.generation_config.get("context_summary_tokens", 64)
+            )
+    
     def generate_qa_pairs(self, 
                         document_text: str, 
                         summary: str, 
                         num_pairs: int = 25) -> List[Dict[str, str]]:
-        """Generate QA pairs from the document using batched processing"""
+        """Generate QA pairs from the document using batched processing
+        
+        With generation.checkpoint_dir set, each chunk's pairs are appended
+        to the document's checkpoint as they arrive, a rerun skips chunks
+        already in it, and the result is assembled in chunk order.
+        
+        Pairs that nearly duplicate an earlier one (see
+        generation.near_duplicate_threshold) are dropped as each chunk is
+        parsed, so they neither count towards the target nor reach curation.
+        """
         verbose = os.environ.get('SDK_VERBOSE', 'false').lower() == 'true'
         
         # Get generation config
@@ -79,7 +119,6 @@ class QAGenerator:
             print(f"Document split into {len(chunks)} chunks")
             print(f"Using batch size of {batch_size}")
         
-        all_qa_pairs = []
         pairs_per_chunk = max(1, round(num_pairs / len(chunks)))
         
         # Get QA generation prompt template
@@ -88,16 +127,14 @@ class QAGenerator:
         # Prepare all message batches
         all_messages = []
         for i, chunk in enumerate(chunks):
-            # Format the prompt with summary and text
-            qa_prompt = qa_prompt_template.format(
+            # Static instructions go first so every chunk's request shares a cacheable prefix
+            messages = build_prompt_messages(
+                qa_prompt_template,
+                "text",
                 num_pairs=pairs_per_chunk,
                 summary=summary[:100],
                 text=chunk
             )
-            
-            messages = [
-                {"role": "system", "content": qa_prompt}
-            ]
             all_messages.append(messages)
         
         print(f"Processing {len(chunks)} chunks to generate QA pairs...")
@@ -121,49 +158,126 @@ class QAGenerator:
             progress_ctx = None
             generate_task = None
         
-        # Process in batches
-        for batch_start in range(0, len(chunks), batch_size):
-            batch_end = min(batch_start + batch_size, len(chunks))
-            batch_messages = all_messages[batch_start:batch_end]
-            current_batch_size = len(batch_messages)
-            
-            batch_num = batch_start//batch_size + 1
-            total_batches = (len(chunks) + batch_size - 1)//batch_size
+        client = self.client.for_stage("generation")
+        
+        # Stop submitting chunks once the target plus curation headroom is met
+        target = None
+        if self.generation_config.get("early_stop", True):
+            headroom = self.generation_config.get("target_headroom", 0.2)
+            target = num_pairs + math.ceil(num_pairs * headroom)
+        
+        options = dict(
+            temperature=temperature,
+            batch_size=batch_size,
+            expect_array=True,
+            max_items=pairs_per_chunk,
+            json_schema=qa_pairs_schema(pairs_per_chunk)
+        )
+        
+        # Chunks finished by an earlier, interrupted run are not sent again
+        checkpoint = ChunkCheckpoint.for_document(
+            self.generation_config.get("checkpoint_dir"), document_text, self.client.document
+        )
+        self.checkpoint = checkpoint
+        chunk_keys = [
+            request_key(dict(
+                messages=messages, model=client.model, reasoning=client.reasoning.key(),
+                temperature=temperature, pairs_per_chunk=pairs_per_chunk
+            ))
+            for messages in all_messages
+        ]
+        chunk_pairs_by_index = checkpoint.load(chunk_keys) if checkpoint else {}
+        all_qa_pairs = [pair for index in sorted(chunk_pairs_by_index) for pair in chunk_pairs_by_index[index]]
+        if chunk_pairs_by_index:
+            print(f"Resuming from checkpoint: {len(chunk_pairs_by_index)} of {len(chunks)} chunks already done")
+        
+        seen = self.pair_index
+        if seen is None:
+            seen = NearDuplicateIndex.from_config(self.generation_config)
+        if seen is not None:
+            # Checkpointed pairs were filtered when generated; they only seed the index
+            for pair in all_qa_pairs:
+                seen.add(_pair_text(pair))
+        duplicates = 0
+        
+        # Visit chunks spread across the document so stopping early doesn't favor its beginning
+        queue = _spread_order(len(chunks)) if target is not None else list(range(len(chunks)))
+        queue = [index for index in queue if index not in chunk_pairs_by_index]
+        retried = set()
+        answered = len(chunk_pairs_by_index)
+        batch_num = 0
+        while queue and (target is None or len(all_qa_pairs) < target):
+            # Size each wave by how many chunks the remaining pairs should take at the observed yield
+            wave_size = batch_size
+            if target is not None:
+                pairs_per_answer = len(all_qa_pairs) / answered if answered else pairs_per_chunk
+                needed = math.ceil((target - len(all_qa_pairs)) / max(pairs_per_answer, 0.5))
+                wave_size = max(1, min(batch_size, needed))
+            candidates = queue[:wave_size]
+            # Packed by estimated tokens, so a wave may be smaller than wave_size
+            wave = [candidates[i] for i in client.plan_waves(
+                [all_messages[i] for i in candidates], max_requests=wave_size
+            )[0]]
+            queue = queue[len(wave):]
+            batch_num += 1
             
             # Simple progress indicator for non-verbose mode
             if not verbose:
-                print(f"Processing batch {batch_num}/{total_batches}...", end="\r")
+                print(f"Processing batch {batch_num}...", end="\r")
             else:
-                print(f"Processing batch {batch_num}/{total_batches} with {current_batch_size} chunks")
+                print(f"Processing batch {batch_num} with {len(wave)} chunks")
             
             try:
-                # Process the batch
-                batch_responses = self.client.batch_completion(
-                    batch_messages,
-                    temperature=temperature,
-                    batch_size=batch_size
-                )
-                
-                # Process each response in the batch
-                for j, response in enumerate(batch_responses):
-                    chunk_index = batch_start + j
-                    chunk_pairs = parse_qa_pairs(response)
-                    all_qa_pairs.extend(chunk_pairs)
-                    
-                    if verbose:
-                        print(f"  Generated {len(chunk_pairs)} pairs from chunk {chunk_index+1}")
-                
-                # Update progress bar if in verbose mode
-                if progress_ctx and generate_task:
-                    progress_ctx.update(generate_task, advance=current_batch_size)
+                with client.usage.scope("qa_generation"):
+                    results = client.iter_batch_completion(
+                        [all_messages[i] for i in wave], return_errors=True, **options
+                    )
+                    try:
+                        for position, response in results:
+                            chunk_index = wave[position]
+                            if progress_ctx and generate_task is not None:
+                                progress_ctx.update(generate_task, advance=1)
+                            if isinstance(response, BatchPendingError):
+                                continue
+                            if isinstance(response, CompletionError):
+                                # Failed chunks get one more try in a later wave
+                                if chunk_index not in retried:
+                                    retried.add(chunk_index)
+                                    queue.append(chunk_index)
+                                elif verbose:
+                                    print(f"  Skipping chunk {chunk_index+1}: {response.message}")
+                                continue
+                            chunk_pairs = parse_qa_pairs(response)
+                            if seen is not None:
+                                parsed = len(chunk_pairs)
+                                chunk_pairs = [p for p in chunk_pairs if seen.add(_pair_text(p))]
+                                duplicates += parsed - len(chunk_pairs)
+                            all_qa_pairs.extend(chunk_pairs)
+                            chunk_pairs_by_index[chunk_index] = chunk_pairs
+                            if checkpoint is not None:
+                                checkpoint.append(chunk_index, chunk_keys[chunk_index], chunk_pairs)
+                            answered += 1
+                            
+                            if verbose:
+                                print(f"  Generated {len(chunk_pairs)} pairs from chunk {chunk_index+1}")
+                            if target is not None and len(all_qa_pairs) >= target:
+                                break
+                    finally:
+                        # Requests of this wave that haven't started are cancelled
+                        results.close()
                 
+            except CircuitOpenError:
+                # The server is down; stop instead of failing every remaining chunk
+                raise
             except Exception as e:
                 if verbose:
                     print(f"  Error processing batch {batch_num}: {str(e)}")
-                
-                # Update progress bar if in verbose mode
-                if progress_ctx and generate_task:
-                    progress_ctx.update(generate_task, advance=current_batch_size)
+        
+        if target is not None and queue and verbose:
+            print(f"Reached {len(all_qa_pairs)} pairs (target {target}); skipped {len(queue)} remaining chunks")
+        
+        # Document order rather than completion order, identical on every resume
+        all_qa_pairs = [pair for index in sorted(chunk_pairs_by_index) for pair in chunk_pairs_by_index[index]]
         
         # Stop progress bar if in verbose mode
         if progress_ctx:
@@ -176,6 +290,12 @@ class QAGenerator:
         
         # Always print summary information, even in non-verbose mode
         print(f"Generated {len(all_qa_pairs)} QA pairs total")
+        if duplicates:
+            print(f"Dropped {duplicates} near-duplicate QA pairs")
+        if client.dedup and client.dedup.coalesced:
+            print(f"Coalesced {client.dedup.coalesced} duplicate requests into existing calls")
+        if client.hedger and client.hedger.issued:
+            print(client.hedger.describe())
         return all_qa_pairs
     
     def rate_qa_pairs(self, 
@@ -226,17 +346,20 @@ class QAGenerator:
                 batch_json = json.dumps(batch, indent=2)
                 
                 # Format the rating prompt with pairs
-                rating_prompt = rating_prompt_template.format(pairs=batch_json)
-                
-                messages = [
-                    {"role": "system", "content": rating_prompt}
-                ]
+                messages = build_prompt_messages(rating_prompt_template, "pairs", pairs=batch_json)
                 
                 try:
-                    response = self.client.chat_completion(
-                        messages, 
-                        temperature=temperature
-                    )
+                    with self.client.usage.scope("rating"):
+                        response = self.client.for_stage("curate").chat_completion(
+                            messages, 
+                            temperature=temperature,
+                            max_tokens=echo_max_tokens(
+                                self.client.tokens, [messages], self.generation_config.get("max_tokens", 4096)
+                            ),
+                            expect_array=True,
+                            max_items=len(batch),
+                            json_schema=ratings_schema(len(batch))
+                        )
                     
                     rated_batch = parse_ratings(response)
                     
@@ -246,6 +369,8 @@ class QAGenerator:
                             if pair["rating"] >= threshold:
                                 rated_pairs.append(pair)
                 
+                except CircuitOpenError:
+                    raise
                 except Exception as e:
                     if verbose:
                         print(f"Error rating batch {i+1}: {str(e)}")
@@ -277,11 +402,33 @@ class QAGenerator:
         else:
             os.environ['SDK_VERBOSE'] = 'false'
         
-        # Generate summary
-        summary = self.generate_summary(document_text)
-        
-        # Generate QA pairs
-        qa_pairs = self.generate_qa_pairs(document_text, summary, num_pairs=num_pairs)
+        # A QA prompt using {summary} waits for a short summary of the opening chunks;
+        # otherwise generation starts at once. The summary kept in the output is
+        # written alongside it
+        uses_summary = "summary" in prompt_fields(get_prompt(self.config, "qa_generation"))
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            summary_job = None
+            if self.generation_config.get("full_summary", True):
+                summary_job = executor.submit(self.generate_summary, document_text)
+            elif not uses_summary:
+                summary_job = executor.submit(self.generate_context_summary, document_text)
+            context = self.generate_context_summary(document_text) if uses_summary else ""
+            
+            # Generate QA pairs
+            qa_pairs = self.generate_qa_pairs(document_text, context, num_pairs=num_pairs)
+            summary = context
+            if summary_job is not None:
+                try:
+                    summary = summary_job.result()
+                except (BatchPendingError, CircuitOpenError):
+                    raise
+                except CompletionError as e:
+                    # The QA pairs are already paid for; don't lose them to the summary
+                    fallback = "the context summary" if context else "an empty summary"
+                    print(f"Warning: summary generation failed, saving {fallback} instead: {e}")
+        finally:
+            executor.shutdown(wait=False)
         
         # Prepare result - no rating at this stage
         result = {
@@ -289,4 +436,15 @@ class QAGenerator:
             "qa_pairs": qa_pairs
         }
         
-        return result
\ No newline at end of file
+        return result
+
+
+def _pair_text(pair: Dict[str, str]) -> str:
+    """Question and answer together, so pairs only match if both nearly repeat"""
+    return f"{pair.get('question', '')}\n{pair.get('answer', '')}"
+
+
+def _spread_order(count: int) -> List[int]:
+    """Order indices 0..count-1 so that any prefix is spread evenly across the range"""
+    golden = (math.sqrt(5) - 1) / 2
+    return sorted(range(count), key=lambda i: (i * golden) % 1.0)
@@ -0,0 +1,96 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Map-reduce summaries for documents too long to summarize in one request
+import os
+from typing import List, Optional
+
+from synthetic_data_kit.models.llm_client import LLMClient
+from synthetic_data_kit.models.errors import CompletionError, BatchPendingError
+from synthetic_data_kit.utils.text import split_into_chunks
+from synthetic_data_kit.utils.config import get_generation_config, get_prompt
+
+
+class SummaryGenerator:
+    """Summarize chunks in parallel, then merge the partial summaries in a tree
+
+    Documents of up to summary_single_pass_chunks chunks are summarized in
+    one request as before. Longer ones are split with split_into_chunks
+    (the same boundaries QA generation uses), each chunk is summarized in
+    one concurrent batch, and groups of summary_fan_in partial summaries
+    are merged level by level until one request can write the final
+    summary. Cost grows linearly with the document and no request sees
+    more than one chunk or fan_in short summaries.
+    """
+
+    def __init__(self, client: LLMClient):
+        """Initialize the summarizer with an LLM client; settings come from its config"""
+        self.client = client
+        self.config = client.config
+        self.generation_config = get_generation_config(self.config)
+
+    def summarize(self, document_text: str, prompt: Optional[str] = None) -> str:
+        """Summarize a document
+
+        Args:
+            document_text: Text to summarize
+            prompt: Instructions for the final summary (defaults to the `summary` prompt)
+
+        Returns:
+            The summary
+        """
+        verbose = os.environ.get('SDK_VERBOSE', 'false').lower() == 'true'
+        prompt = prompt or get_prompt(self.config, "summary")
+        client = self.client.for_stage("summary")
+
+        chunks = split_into_chunks(
+            document_text,
+            chunk_size=self.generation_config.get("chunk_size", 4000),
+            overlap=self.generation_config.get("overlap", 200)
+        )
+        single_pass = self.generation_config.get("summary_single_pass_chunks", 4)
+        fan_in = max(2, self.generation_config.get("summary_fan_in", 8))
+
+        with client.usage.scope("summary"):
+            if len(chunks) <= single_pass:
+                return self._complete(client, prompt, document_text)
+
+            if verbose:
+                print(f"Summarizing {len(chunks)} chunks in parallel before combining them")
+            # Configs written before the map/reduce prompts existed reuse the final prompt
+            prompts = self.config.get('prompts', {})
+            parts = self._summarize_all(client, prompts.get("summary_map", prompt), chunks)
+
+            level = 1
+            while len(parts) > fan_in:
+                groups = [parts[i:i + fan_in] for i in range(0, len(parts), fan_in)]
+                if verbose:
+                    print(f"Combining {len(parts)} partial summaries into {len(groups)} (level {level})")
+                parts = self._summarize_all(
+                    client, prompts.get("summary_reduce", prompt), ["\n\n".join(group) for group in groups]
+                )
+                level += 1
+
+            return self._complete(client, prompt, "\n\n".join(parts))
+
+    def _complete(self, client: LLMClient, prompt: str, text: str) -> str:
+        return client.chat_completion(
+            [{"role": "system", "content": prompt}, {"role": "user", "content": text}],
+            temperature=0.1  # Use lower temperature for summaries
+        )
+
+    def _summarize_all(self, client: LLMClient, prompt: str, texts: List[str]) -> List[str]:
+        """Summarize texts concurrently, in order, dropping any that fail"""
+        message_batches = [[{"role": "system", "content": prompt}, {"role": "user", "content": text}] for text in texts]
+        options = dict(temperature=0.1, max_tokens=self.generation_config.get("summary_chunk_tokens", 256))
+        results = client.batch_completion(message_batches, return_errors=True, **options)
+        results = client.retry_failed(message_batches, results, **options)
+        pending = [r for r in results if isinstance(r, BatchPendingError)]
+        if pending:
+            raise pending[0]
+        parts = [r for r in results if not isinstance(r, CompletionError)]
+        if not parts:
+            raise results[0]
+        return parts
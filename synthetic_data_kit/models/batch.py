@@ -0,0 +1,113 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Offline batch execution: write OpenAI batch-format requests and read back their results
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Union
+
+BATCH_URL = "/v1/chat/completions"
+
+# Request fields that only make sense for live HTTP calls
+_LIVE_ONLY_FIELDS = ("stream", "stream_options")
+
+
+def load_batch_results(paths: List[Union[str, Path]]) -> Dict[str, str]:
+    """Read batch output JSONL files into a mapping of custom_id to completion text
+
+    Lines that report an error or a non-200 status are skipped so the request
+    is written to the next batch file (or sent live) instead.
+    """
+    verbose = os.environ.get('SDK_VERBOSE', 'false').lower() == 'true'
+    results = {}
+    failed = 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                body = response.get("body") or {}
+                if record.get("error") or response.get("status_code", 200) != 200 or not body.get("choices"):
+                    failed += 1
+                    continue
+                results[record["custom_id"]] = body["choices"][0]["message"]["content"]
+    if verbose and failed:
+        print(f"Skipped {failed} failed batch results")
+    return results
+
+
+class BatchJob:
+    """Defer requests to an OpenAI batch-format JSONL file and answer them from ingested results
+
+    Every request is identified by its response cache key, so the custom_id
+    is the same on every run with the same inputs and config. A run with only
+    ingested results reproduces the live pipeline's outputs; requests that
+    depend on earlier results (QA generation needs the summary) are written
+    on a later pass once those results have been ingested.
+    """
+
+    def __init__(self,
+                 path: Optional[Union[str, Path]] = None,
+                 results: Optional[Dict[str, str]] = None):
+        """Initialize the batch job
+
+        Args:
+            path: JSONL file to write deferred requests to (None to send misses live)
+            results: Completion text per custom_id from load_batch_results
+        """
+        self.path = str(path) if path is not None else None
+        self.results = results or {}
+        self.used = 0
+        self._ids = set()
+        self._documents: Dict[Optional[str], int] = {}
+        self._lock = threading.Lock()
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            open(self.path, 'w', encoding='utf-8').close()
+
+    @property
+    def pending(self) -> int:
+        """Number of requests written to the batch file"""
+        return len(self._ids)
+
+    def pending_for(self, document: Optional[str]) -> int:
+        """Number of requests a document deferred, so other documents can still be written"""
+        with self._lock:
+            return self._documents.get(document, 0)
+
+    def lookup(self, custom_id: str) -> Optional[str]:
+        content = self.results.get(custom_id)
+        if content is not None:
+            with self._lock:
+                self.used += 1
+        return content
+
+    def defer(self, custom_id: str, data: Dict[str, Any], document: Optional[str] = None) -> bool:
+        """Append a request to the batch file; False when no batch file is being written"""
+        if self.path is None:
+            return False
+        body = {k: v for k, v in data.items() if k not in _LIVE_ONLY_FIELDS}
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_URL, "body": body})
+        with self._lock:
+            self._documents[document] = self._documents.get(document, 0) + 1
+            if custom_id in self._ids:
+                return True
+            self._ids.add(custom_id)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        return True
+
+    def describe(self, model: Optional[str] = None) -> str:
+        if not self.pending:
+            return f"Answered {self.used} requests from batch results"
+        model = model or "<model>"
+        return (f"Wrote {self.pending} requests to {self.path}\n"
+                f"Run them, e.g. python -m vllm.entrypoints.openai.run_batch -i {self.path} "
+                f"-o results.jsonl --model {model}\n"
+                f"then rerun with --ingest-results results.jsonl")
@@ -0,0 +1,164 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# On-disk cache of LLM responses so reruns don't resend identical prompts
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+
+# Request fields that change how a response is delivered but not what it says
+TRANSPORT_FIELDS = ("stream", "stream_options")
+
+
+class ResponseCache:
+    """Content-addressed SQLite cache with a byte cap and LRU eviction"""
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_bytes: int = 1 << 30,
+                 enabled: bool = True,
+                 refresh: bool = False):
+        """Initialize the cache
+
+        Args:
+            path: SQLite file to store responses in
+            max_bytes: Evict least recently used entries beyond this size
+            enabled: When False, every lookup misses and nothing is stored
+            refresh: Ignore existing entries but still store new responses
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled and path is not None
+        self.refresh = refresh
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._size = 0
+
+        if self.enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+            )
+            self._conn.commit()
+            self._size = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+
+    @classmethod
+    def from_config(cls,
+                    config: Dict[str, Any],
+                    enabled: Optional[bool] = None,
+                    refresh: bool = False) -> 'ResponseCache':
+        """Create a cache from the `cache` config section, with optional CLI overrides"""
+        cache_config = config.get('cache', {}) or {}
+        if enabled is None:
+            enabled = cache_config.get('enabled', False)
+        return cls(
+            path=cache_config.get('path', 'data/cache/llm_responses.sqlite'),
+            max_bytes=cache_config.get('max_bytes', 1 << 30),
+            enabled=enabled,
+            refresh=refresh,
+        )
+
+    @staticmethod
+    def make_key(request: Dict[str, Any]) -> str:
+        """Hash the model, messages and sampling parameters of a request"""
+        content = {k: v for k, v in request.items() if k not in TRANSPORT_FIELDS}
+        canonical = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Look up a cached response, refreshing its LRU position on a hit"""
+        if not self.enabled or self.refresh:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """Store a response and evict old entries if the cache is over its byte cap"""
+        if not self.enabled:
+            return
+
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._size -= row[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self._size += size
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._size <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+            "evictions": self.evictions,
+            "size_bytes": self._size,
+        }
+
+    def describe(self) -> str:
+        """One-line summary for CLI output"""
+        stats = self.stats()
+        return (f"Response cache: {stats['hits']} hits, {stats['misses']} misses "
+                f"({stats['hit_rate']:.0%} hit rate), {stats['size_bytes'] / 1e6:.1f} MB, "
+                f"{stats['evictions']} evicted")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self.enabled = False
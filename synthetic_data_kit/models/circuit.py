@@ -0,0 +1,106 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Circuit breakers that stop sending requests to a server that keeps failing
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open probe -> closed or open again
+
+    While open, allow() refuses every request so callers fail at once
+    instead of waiting out their retries. Once reset_timeout has passed,
+    a single probe request is let through: its success closes the circuit,
+    its failure or an overloaded answer opens it for another reset_timeout.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 10, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def ready(self) -> bool:
+        """True if a request could be let through now (without claiming the probe)"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return self.state == CLOSED
+
+    def allow(self) -> bool:
+        """Claim permission to send one request"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._log("half-open, sending a probe")
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self._log("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                self._log(f"open after {self.consecutive_failures} consecutive failures")
+
+    def record_overload(self):
+        """A 429/503 says nothing about failures, but a probe that gets one has not passed"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._log("open again, probe was answered overloaded")
+
+    def _log(self, message: str):
+        if os.environ.get('SDK_VERBOSE', 'false').lower() == 'true':
+            print(f"Circuit for {self.name} {message}")
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url: str, settings: Dict[str, Any]) -> Optional[CircuitBreaker]:
+    """The process-wide breaker for a server URL, or None if circuit breaking is disabled
+
+    Every client talking to the same server shares its breaker, so one
+    client's failures stop the others from piling retries onto it.
+    """
+    if not settings.get('enabled', True):
+        return None
+    with _breakers_lock:
+        breaker = _breakers.get(url)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                url,
+                failure_threshold=settings.get('failure_threshold', 10),
+                reset_timeout=settings.get('reset_timeout', 30.0),
+            )
+            _breakers[url] = breaker
+        return breaker
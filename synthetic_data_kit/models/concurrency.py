@@ -0,0 +1,185 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Adaptive concurrency control for VLLM requests
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Any, Hashable, List, Optional
+
+
+class AdaptiveLimiter:
+    """AIMD limiter for the number of requests in flight against a server
+
+    The limit grows by roughly one request per window of healthy responses and
+    is cut multiplicatively when the server signals overload (429/503),
+    a request times out, or latency rises and stays up. Until the first
+    such signal it is in slow start and grows by one per success instead,
+    doubling every window, so a short run reaches the server's capacity
+    rather than spending it creeping up from the initial limit.
+
+    Latency is tracked separately per class of request (the caller passes
+    a key such as stage and max_tokens), since short ratings and long
+    generations differ far more than load ever moves them. Within a class,
+    the low percentile of the last `window` requests is compared with the
+    low percentile of the requests before them: ordinary spread and the odd
+    slow request leave the two alike, while a loaded server slows even its
+    fastest requests. After a cut the class needs a fresh window before the
+    next one.
+    """
+
+    def __init__(self,
+                 initial: int = 8,
+                 min_limit: int = 1,
+                 max_limit: int = 256,
+                 latency_tolerance: float = 2.0,
+                 backoff: float = 0.5,
+                 cooldown: float = 1.0,
+                 window: int = 16,
+                 history: int = 256,
+                 percentile: float = 0.25):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.window = max(1, window)
+        self.history = max(2 * self.window, history)
+        self.percentile = percentile
+
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._signals: Dict[Hashable, Deque[float]] = {}
+        self._slow_start = True
+        self._last_decrease = 0.0
+        self._successes = 0
+        self._failures = 0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls, vllm_config: Dict[str, Any]) -> Optional['AdaptiveLimiter']:
+        """Build a limiter from the `adaptive_concurrency` section, or None if disabled"""
+        settings = vllm_config.get('adaptive_concurrency', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        return cls(
+            initial=settings.get('initial', vllm_config.get('max_in_flight', 32)),
+            min_limit=settings.get('min', 1),
+            max_limit=settings.get('max', 256),
+            latency_tolerance=settings.get('latency_tolerance', 2.0),
+            backoff=settings.get('backoff', 0.5),
+            cooldown=settings.get('cooldown', 1.0),
+            window=settings.get('window', 16),
+        )
+
+    @classmethod
+    def fixed(cls, limit: int) -> 'AdaptiveLimiter':
+        """A limiter that holds the window at limit, for sharing a fixed in-flight cap"""
+        return cls(initial=limit, min_limit=limit, max_limit=limit)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self):
+        """Block until a slot is free under the current limit"""
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def record_success(self,
+                       latency: float,
+                       completion_tokens: Optional[int] = None,
+                       ttft: Optional[float] = None,
+                       key: Hashable = None):
+        """Feed back a successful request
+
+        Time-to-first-token is the best load signal when known. Otherwise the
+        latency is normalized per generated token.
+
+        Args:
+            key: Class of the request; latencies are only compared within a class
+        """
+        if ttft is not None:
+            signal, key = ttft, ("ttft", key)
+        elif completion_tokens:
+            signal, key = latency / completion_tokens, ("per_token", key)
+        else:
+            signal, key = latency, ("latency", key)
+        with self._cond:
+            self._successes += 1
+            signals = self._signals.get(key)
+            if signals is None:
+                signals = self._signals[key] = deque(maxlen=self.history)
+            signals.append(signal)
+
+            rise = self._sustained_rise(signals)
+            if rise is not None:
+                # The next cut for this class has to be earned by a whole new window
+                for _ in range(self.window):
+                    signals.pop()
+                self._decrease(f"recent latency {rise:.1f}x baseline")
+            elif self._limit < self.max_limit:
+                step = 1.0 if self._slow_start else 1.0 / self._limit
+                self._limit = min(self.max_limit, self._limit + step)
+                self._cond.notify_all()
+
+    def _sustained_rise(self, signals: Deque[float]) -> Optional[float]:
+        """Ratio of the recent window's low percentile to the baseline's, if above tolerance"""
+        if len(signals) < 2 * self.window:
+            return None
+        values = list(signals)
+        baseline = _percentile(values[:-self.window], self.percentile)
+        recent = _percentile(values[-self.window:], self.percentile)
+        if baseline > 0 and recent > baseline * self.latency_tolerance:
+            return recent / baseline
+        return None
+
+    def record_failure(self, reason: str):
+        """Feed back an overload signal (429/503 or timeout)"""
+        with self._cond:
+            self._failures += 1
+            self._decrease(reason)
+
+    def _decrease(self, reason: str):
+        self._slow_start = False
+        # Concurrent failures from the same burst should only cut the limit once
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+
+        old_limit = int(self._limit)
+        self._limit = max(float(self.min_limit), self._limit * self.backoff)
+        if os.environ.get('SDK_VERBOSE', 'false').lower() == 'true':
+            print(f"Concurrency limit {old_limit} -> {int(self._limit)} ({reason})")
+
+    def describe(self) -> str:
+        """One-line summary of the controller state for verbose output"""
+        return (f"limit={int(self._limit)} in_flight={self._in_flight} "
+                f"classes={len(self._signals)} ok={self._successes} overloaded={self._failures}")
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))]
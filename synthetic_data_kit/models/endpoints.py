@@ -0,0 +1,219 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Routing across several VLLM replicas
+import os
+import threading
+from typing import Dict, Any, List, Optional, Union
+
+import requests
+
+from synthetic_data_kit.models.circuit import CircuitBreaker, get_breaker
+from synthetic_data_kit.models.errors import CircuitOpenError
+
+
+def parse_api_bases(api_base: Union[str, List[str], None]) -> List[str]:
+    """Normalize an api_base setting (a URL, comma-separated URLs or a list) into a list"""
+    if api_base is None:
+        return []
+    if isinstance(api_base, str):
+        api_base = api_base.split(",")
+    return [url.strip().rstrip("/") for url in api_base if url and url.strip()]
+
+
+class Endpoint:
+    """One VLLM replica and its routing statistics"""
+
+    def __init__(self, url: str, breaker: Optional[CircuitBreaker] = None, standby: bool = False):
+        self.url = url
+        self.breaker = breaker
+        self.standby = standby
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.ewma_latency: Optional[float] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "standby": self.standby,
+            "circuit": self.breaker.state if self.breaker else None,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "mean_latency": round(self.total_latency / self.requests, 3) if self.requests else None,
+            "ewma_latency": round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+        }
+
+
+class EndpointPool:
+    """Least-outstanding-requests router with health checks, ejection and circuit breakers
+
+    Standby endpoints only receive requests while the circuit of every
+    primary endpoint is open. When no endpoint's circuit will let a
+    request through, acquire() fails fast with CircuitOpenError.
+    """
+
+    def __init__(self,
+                 api_bases: List[str],
+                 session: requests.Session,
+                 health_check_interval: float = 10.0,
+                 eject_after: int = 3,
+                 health_timeout: float = 5.0,
+                 fallback_bases: Optional[List[str]] = None,
+                 circuit_breaker: Optional[Dict[str, Any]] = None):
+        """Initialize the pool
+
+        Args:
+            api_bases: Base URLs of the replicas
+            session: HTTP session used for health checks
+            health_check_interval: Seconds between background /models probes
+            eject_after: Consecutive failures before a replica is taken out of rotation
+            health_timeout: Timeout for each health probe
+            fallback_bases: Standby servers to fail over to
+            circuit_breaker: Breaker settings (enabled, failure_threshold, reset_timeout);
+                if None, circuit breaking is off
+        """
+        if not api_bases:
+            raise ValueError("At least one VLLM api_base is required")
+        breaker_settings = circuit_breaker if circuit_breaker is not None else {"enabled": False}
+        self.endpoints = [Endpoint(url, get_breaker(url, breaker_settings)) for url in api_bases]
+        self.endpoints += [
+            Endpoint(url, get_breaker(url, breaker_settings), standby=True)
+            for url in fallback_bases or [] if url not in api_bases
+        ]
+        self.session = session
+        self.health_check_interval = health_check_interval
+        self.eject_after = eject_after
+        self.health_timeout = health_timeout
+
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def acquire(self) -> Endpoint:
+        """Pick the healthy replica with the fewest requests in flight
+
+        Raises:
+            CircuitOpenError: If every endpoint's circuit is open
+        """
+        if len(self.endpoints) > 1:
+            self._start_health_checks()
+        with self._lock:
+            for standby in (False, True):
+                tier = [e for e in self.endpoints if e.standby == standby and (e.breaker is None or e.breaker.ready())]
+                # Everything is ejected: keep trying rather than failing the whole run
+                candidates = [e for e in tier if e.healthy] or tier
+                for endpoint in sorted(candidates, key=lambda e: (e.outstanding, e.ewma_latency or 0.0)):
+                    # A half-open circuit lets only one probe through
+                    if endpoint.breaker is None or endpoint.breaker.allow():
+                        endpoint.outstanding += 1
+                        return endpoint
+        raise CircuitOpenError(
+            f"No VLLM endpoint is accepting requests: circuit open for {', '.join(e.url for e in self.endpoints)}"
+        )
+
+    def available(self) -> bool:
+        """False while every endpoint's circuit is open"""
+        return any(e.breaker is None or e.breaker.ready() for e in self.endpoints)
+
+    def release(self, endpoint: Endpoint, latency: Optional[float] = None, ok: bool = True, overloaded: bool = False):
+        """Record the outcome of a request routed to endpoint
+
+        An overloaded (429/503) response is left to the concurrency limiter
+        and does not count towards opening the endpoint's circuit, though
+        it does reopen a half-open one rather than leave it waiting.
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.requests += 1
+            if endpoint.breaker is not None:
+                if overloaded:
+                    endpoint.breaker.record_overload()
+                elif ok:
+                    endpoint.breaker.record_success()
+                else:
+                    endpoint.breaker.record_failure()
+            if ok:
+                endpoint.consecutive_failures = 0
+                if latency is not None:
+                    endpoint.total_latency += latency
+                    if endpoint.ewma_latency is None:
+                        endpoint.ewma_latency = latency
+                    else:
+                        endpoint.ewma_latency = 0.8 * endpoint.ewma_latency + 0.2 * latency
+            else:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.healthy and endpoint.consecutive_failures >= self.eject_after:
+                    self._set_health(endpoint, False, f"{endpoint.consecutive_failures} consecutive failures")
+
+    def check(self, endpoint: Endpoint) -> bool:
+        """Probe a replica's /models endpoint and update its health"""
+        try:
+            response = self.session.get(f"{endpoint.url}/models", timeout=self.health_timeout)
+            healthy = response.status_code == 200
+            reason = f"status {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            healthy = False
+            reason = str(e)
+        with self._lock:
+            if healthy:
+                endpoint.consecutive_failures = 0
+            if healthy != endpoint.healthy:
+                self._set_health(endpoint, healthy, "health check passed" if healthy else reason)
+        return healthy
+
+    def check_all(self) -> bool:
+        """Probe every replica; True if at least one is healthy"""
+        return any([self.check(endpoint) for endpoint in self.endpoints])
+
+    def _set_health(self, endpoint: Endpoint, healthy: bool, reason: str):
+        endpoint.healthy = healthy
+        if os.environ.get('SDK_VERBOSE', 'false').lower() == 'true':
+            state = "re-admitted" if healthy else "ejected"
+            print(f"Endpoint {endpoint.url} {state} ({reason})")
+
+    def _start_health_checks(self):
+        if self._health_thread is not None or self.health_check_interval <= 0:
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_check_interval):
+            for endpoint in self.endpoints:
+                self.check(endpoint)
+
+    def close(self):
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-endpoint routing and latency statistics"""
+        with self._lock:
+            return {endpoint.url: endpoint.stats() for endpoint in self.endpoints}
+
+    def describe(self) -> str:
+        """Multi-line summary for verbose output"""
+        lines = []
+        for url, stats in self.stats().items():
+            state = "up" if stats["healthy"] else "ejected"
+            if stats["circuit"] not in (None, "closed"):
+                state += f", circuit {stats['circuit']}"
+            if stats["standby"]:
+                state += ", standby"
+            latency = f"{stats['ewma_latency']}s" if stats["ewma_latency"] is not None else "n/a"
+            lines.append(f"  {url} [{state}] requests={stats['requests']} "
+                         f"failures={stats['failures']} latency={latency}")
+        return "\n".join(lines)
@@ -0,0 +1,47 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Errors raised or returned by the LLM client
+from typing import List, Optional, Union
+
+
+class CompletionError(Exception):
+    """A single request that failed after all of its retries"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, attempts: int = 0):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.attempts = attempts
+
+    def __repr__(self) -> str:
+        return f"CompletionError(status_code={self.status_code}, attempts={self.attempts}, message={self.message!r})"
+
+
+class BatchCompletionError(Exception):
+    """Some requests in a batch failed; completed results are kept alongside the errors"""
+
+    def __init__(self, results: List[Union[str, CompletionError]]):
+        self.results = results
+        self.errors = [r for r in results if isinstance(r, CompletionError)]
+        first = self.errors[0].message if self.errors else "unknown error"
+        super().__init__(
+            f"Failed to process batch: {len(self.errors)} of {len(results)} requests failed ({first})"
+        )
+
+
+class BatchPendingError(CompletionError):
+    """A request was written to a batch file instead of being sent; its result comes from a later ingest"""
+
+    def __init__(self, custom_id: str):
+        super().__init__(f"Request {custom_id} deferred to the batch file")
+        self.custom_id = custom_id
+
+
+class CircuitOpenError(CompletionError):
+    """Every endpoint's circuit breaker is open, so the request was not sent"""
+
+    def __init__(self, message: str = "No VLLM endpoint is accepting requests (circuit open)"):
+        super().__init__(message)
@@ -0,0 +1,160 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Hedged requests: race a duplicate against requests that are slower than usual
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Callable, Optional
+
+
+class HedgeSignal:
+    """Shared between a hedger and one call: when the request went out, and whether to stop"""
+
+    def __init__(self, hedge: bool = False):
+        self.hedge = hedge
+        self.sent = threading.Event()
+        self.sent_at: Optional[float] = None
+        self.cancel = threading.Event()
+
+    def mark_sent(self):
+        """Called once the request holds a concurrency slot, so queueing time is not counted"""
+        if not self.sent.is_set():
+            self.sent_at = time.monotonic()
+            self.sent.set()
+
+    def is_cancelled(self) -> bool:
+        return self.cancel.is_set()
+
+
+class Hedger:
+    """Fire a duplicate of any request that outlives a latency percentile and keep the first answer
+
+    Latency is measured from the moment a request is actually sent, not
+    from when it was queued behind the concurrency limit. The duplicate goes
+    through the normal endpoint routing, so with several replicas it usually
+    lands on a different one, and it skips the adaptive concurrency queue
+    since waiting there would defeat the point. The loser is told to stop through its signal;
+    a streamed response then closes its connection, which makes VLLM abort
+    the generation.
+    """
+
+    def __init__(self,
+                 percentile: float = 0.95,
+                 min_samples: int = 20,
+                 window: int = 500,
+                 min_delay: float = 1.0,
+                 max_workers: int = 64):
+        """Initialize the hedger
+
+        Args:
+            percentile: Observed latency percentile after which a hedge is fired
+            min_samples: Latencies to observe before hedging starts
+            window: Number of recent latencies the percentile is computed over
+            min_delay: Never hedge before this many seconds
+            max_workers: Threads available to run primaries and hedges
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = deque(maxlen=window)
+        self.issued = 0
+        self.won = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    @classmethod
+    def from_config(cls, vllm_config: Dict[str, Any], max_workers: int) -> Optional['Hedger']:
+        """Build a hedger from the `hedging` block of the VLLM config, or None if disabled"""
+        settings = vllm_config.get('hedging') or {}
+        if not settings.get('enabled', False):
+            return None
+        return cls(
+            percentile=settings.get('percentile', 0.95),
+            min_samples=settings.get('min_samples', 20),
+            window=settings.get('window', 500),
+            min_delay=settings.get('min_delay', 1.0),
+            max_workers=max_workers,
+        )
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there are too few observations"""
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.min_delay, ordered[index])
+
+    def run(self, fn: Callable[[HedgeSignal], Any]) -> Any:
+        """Call fn(signal), racing a second call if the first is slow once sent
+
+        Returns:
+            The result of whichever call succeeds first
+
+        Raises:
+            The error of the last call to fail if none succeeds
+        """
+        delay = self.delay()
+        if delay is None:
+            signal = HedgeSignal()
+            result = fn(signal)
+            self._observe(signal)
+            return result
+
+        signals = {}
+        primary_signal = HedgeSignal()
+        primary = self._pool.submit(fn, primary_signal)
+        signals[primary] = primary_signal
+        
+        # Wait out the concurrency queue, then give the request its usual time
+        while not primary_signal.sent.wait(0.05) and not primary.done():
+            pass
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            result = primary.result()
+            self._observe(primary_signal)
+            return result
+
+        hedge_signal = HedgeSignal(hedge=True)
+        hedge = self._pool.submit(fn, hedge_signal)
+        signals[hedge] = hedge_signal
+        with self._lock:
+            self.issued += 1
+
+        pending = set(signals)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                for other in pending:
+                    signals[other].cancel.set()
+                    other.cancel()
+                with self._lock:
+                    if future is hedge:
+                        self.won += 1
+                # One sample per request: how long the primary took or had been waiting,
+                # never the hedge's time, or a won hedge would pull the percentile down
+                self._observe(primary_signal, at_least=delay)
+                return result
+        raise error
+
+    def _observe(self, signal: HedgeSignal, at_least: float = 0.0):
+        if signal.sent_at is None:
+            return
+        with self._lock:
+            self.latencies.append(max(at_least, time.monotonic() - signal.sent_at))
+
+    def describe(self) -> str:
+        return f"Hedged {self.issued} slow requests, {self.won} hedges finished first"
+
+    def close(self):
+        self._pool.shutdown(wait=False)
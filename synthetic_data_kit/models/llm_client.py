@@ -4,169 +4,824 @@
 # This source code is licensed under the terms described in the LICENSE file in
 # the root directory of this source tree.
 # vLLM logic: Will be expanded to ollama and Cerebras in future.
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Union, Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 import json
 import time
 import os
+import random
+import threading
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 
-from synthetic_data_kit.utils.config import load_config, get_vllm_config
+from synthetic_data_kit.utils.config import load_config, get_vllm_config, get_stage_profile
+from synthetic_data_kit.models.session import build_session, get_timeouts, AdaptiveTimeout
+from synthetic_data_kit.models.concurrency import AdaptiveLimiter
+from synthetic_data_kit.models.cache import ResponseCache
+from synthetic_data_kit.models.singleflight import SingleFlight
+from synthetic_data_kit.models.endpoints import EndpointPool, parse_api_bases
+from synthetic_data_kit.models.streaming import read_chat_stream
+from synthetic_data_kit.models.metrics import PrefixCacheMonitor
+from synthetic_data_kit.models.errors import CompletionError, BatchCompletionError, BatchPendingError, CircuitOpenError
+from synthetic_data_kit.models.batch import BatchJob
+from synthetic_data_kit.models.usage import UsageTracker
+from synthetic_data_kit.models.hedging import Hedger, HedgeSignal
+from synthetic_data_kit.models.reasoning import ReasoningControl, ReasoningLog, reasoning_text
+from synthetic_data_kit.utils.tokens import TokenEstimator, pack_waves, load_tokenizer
+
+# Status codes VLLM (or a proxy in front of it) returns when it is overloaded
+OVERLOAD_STATUS_CODES = (429, 503)
 
 class LLMClient:
     def __init__(self, 
                  config_path: Optional[Path] = None,
-                 api_base: Optional[str] = None, 
+                 api_base: Optional[Union[str, List[str]]] = None, 
                  model_name: Optional[str] = None,
                  max_retries: Optional[int] = None,
-                 retry_delay: Optional[float] = None):
+                 retry_delay: Optional[float] = None,
+                 session: Optional[requests.Session] = None,
+                 check_server: bool = True,
+                 cache: Optional[ResponseCache] = None,
+                 batch: Optional[BatchJob] = None,
+                 usage: Optional[UsageTracker] = None,
+                 document: Optional[str] = None,
+                 reasoning: Optional[Union[str, Dict[str, Any]]] = None,
+                 reasoning_log: Optional[ReasoningLog] = None,
+                 limiter: Optional[AdaptiveLimiter] = None):
         """Initialize an OpenAI-compatible client that connects to a VLLM server
         
         Args:
             config_path: Path to config file (if None, uses default)
-            api_base: Override API base URL from config
+            api_base: Override API base URL(s) from config; a list or comma-separated
+                string spreads requests across several replicas
             model_name: Override model name from config
             max_retries: Override max retries from config
             retry_delay: Override retry delay from config
+            session: Shared HTTP session (if None, the client creates its own pool)
+            check_server: Verify the server is reachable before returning
+            cache: Response cache to use (if None, built from the `cache` config section)
+            batch: Offline batch job that answers requests from ingested results
+                and/or defers the rest to a batch file instead of sending them
+            usage: Usage tracker to record calls in (if None, the client keeps its own)
+            document: Document name calls are attributed to in the usage report
+            reasoning: Reasoning mode or settings applied over the `reasoning` config block
+            reasoning_log: Log that receives the reasoning behind every answer (if None, it is dropped)
+            limiter: In-flight limiter shared with other clients of the same server
+                (if None, built from the `adaptive_concurrency` config section)
         """
         # Load config
+        self.config_path = config_path
         self.config = load_config(config_path)
         vllm_config = get_vllm_config(self.config)
         
         # Set parameters, with CLI overrides taking precedence
-        self.api_base = api_base or vllm_config.get('api_base')
+        api_bases = parse_api_bases(api_base or vllm_config.get('api_base'))
+        self.api_base = api_bases[0] if api_bases else None
+        self.api_bases = api_bases
         self.model = model_name or vllm_config.get('model')
         self.max_retries = max_retries or vllm_config.get('max_retries')
         self.retry_delay = retry_delay or vllm_config.get('retry_delay')
+        self.max_retry_delay = vllm_config.get('max_retry_delay', 30.0)
+        self.max_in_flight = vllm_config.get('max_in_flight') or self.config.get('generation', {}).get('batch_size', 32)
+        self.streaming = vllm_config.get('streaming', False)
+        
+        # How JSON schemas are sent: "response_format" (OpenAI style), "guided_json" (older VLLM) or "none"
+        self.guided_decoding = str(vllm_config.get('guided_decoding', 'response_format')).lower()
+        if self.guided_decoding not in ('response_format', 'guided_json', 'none', 'false'):
+            raise ValueError(f"Unknown guided_decoding mode: {self.guided_decoding}")
+        
+        # "completions" renders chat templates locally and sends whole waves as one multi-prompt request
+        self.backend = vllm_config.get('backend', 'chat')
+        self.multi_prompt_size = vllm_config.get('multi_prompt_size', 32)
+        self.chat_tokenizer = None
+        if self.backend == 'completions':
+            tokenizer_name = vllm_config.get('tokenizer') or self.model
+            self.chat_tokenizer = load_tokenizer(tokenizer_name)
+            if self.chat_tokenizer is None:
+                raise ValueError(
+                    f"The completions backend needs the `transformers` package and a chat template "
+                    f"for {tokenizer_name} to render prompts; set vllm.backend to 'chat' instead"
+                )
+        elif self.backend != 'chat':
+            raise ValueError(f"Unknown VLLM backend: {self.backend}")
+        
+        # Token estimates used to pack requests into waves that fit the server's batch budget
+        self.tokens = TokenEstimator.from_config(vllm_config)
+        self.token_budget = vllm_config.get('token_budget')
+        
+        # Reuse the caller's connection pool so keep-alive connections survive across clients
+        self.session = session or build_session(vllm_config)
+        self.timeout = get_timeouts(vllm_config)
+        self.adaptive_timeout = AdaptiveTimeout.from_config(vllm_config)
+        self.endpoints = EndpointPool(
+            api_bases,
+            self.session,
+            health_check_interval=vllm_config.get('health_check_interval', 10.0),
+            eject_after=vllm_config.get('eject_after', 3),
+            health_timeout=self.timeout[0],
+            fallback_bases=parse_api_bases(vllm_config.get('fallback_api_base')),
+            circuit_breaker=vllm_config.get('circuit_breaker') or {}
+        )
+        
+        # Optional AIMD controller that replaces the fixed in-flight window
+        self.limiter = limiter or AdaptiveLimiter.from_config(vllm_config)
+        
+        # Optional duplicate requests for calls that run past a latency percentile
+        max_window = self.limiter.max_limit if self.limiter else self.max_in_flight
+        self.hedger = Hedger.from_config(vllm_config, max_workers=2 * max_window)
+        
+        # Identical requests are answered from disk instead of the server
+        self.cache = cache or ResponseCache.from_config(self.config)
+        
+        # Identical requests in flight at the same time share one upstream call
+        self.dedup = SingleFlight() if vllm_config.get('dedup_requests', True) else None
+        
+        self.batch = batch
+        
+        # Per-call token usage and latency, tagged by stage and document
+        self.usage = usage or UsageTracker()
+        self.document = document
+        
+        # Thinking on, off or capped for reasoning models
+        self.reasoning_override = reasoning
+        self.reasoning = ReasoningControl.from_config(vllm_config.get('reasoning'), reasoning)
+        self.reasoning_log = reasoning_log
+        
+        # Clients for stages whose profile points at another model or server
+        self._stage_clients: Dict[Tuple[str, ...], 'LLMClient'] = {}
+        self._stage_lock = threading.Lock()
         
         # Verify server is running
-        available, info = self._check_server()
-        if not available:
-            raise ConnectionError(f"VLLM server not available at {self.api_base}: {info}")
+        if check_server:
+            available, info = self._check_server()
+            if not available:
+                raise ConnectionError(f"VLLM server not available at {', '.join(api_bases)}: {info}")
     
     def _check_server(self) -> tuple:
         """Check if the VLLM server is running and accessible"""
+        if len(self.endpoints) > 1:
+            if self.endpoints.check_all():
+                return True, self.endpoints.stats()
+            return False, "No healthy endpoints"
         try:
-            response = requests.get(f"{self.api_base}/models", timeout=5)
+            response = self.session.get(f"{self.api_base}/models", timeout=self.timeout[0])
             if response.status_code == 200:
                 return True, response.json()
             return False, f"Server returned status code: {response.status_code}"
         except requests.exceptions.RequestException as e:
             return False, f"Server connection error: {str(e)}"
     
-    def chat_completion(self, 
-                      messages: List[Dict[str, str]], 
-                      temperature: float = None, 
-                      max_tokens: int = None,
-                      top_p: float = None) -> str:
-        """Generate a chat completion using the VLLM OpenAI-compatible API"""
-        # Get defaults from config if not provided
-        generation_config = self.config.get('generation', {})
-        temperature = temperature if temperature is not None else generation_config.get('temperature', 0.1)
-        max_tokens = max_tokens if max_tokens is not None else generation_config.get('max_tokens', 4096)
-        top_p = top_p if top_p is not None else generation_config.get('top_p', 0.95)
+    def plan_waves(self,
+                   message_batches: List[List[Dict[str, str]]],
+                   max_tokens: int = None,
+                   max_requests: int = None) -> List[List[int]]:
+        """Split requests into submission waves by estimated tokens and request count
+        
+        Each request costs its estimated prompt tokens plus its expected
+        completion tokens. Waves are capped at vllm.token_budget (set it to
+        the server's max_num_batched_tokens or KV-cache capacity) so short
+        rating prompts pack densely and long chunks don't trigger preemption.
         
+        Returns:
+            Lists of indices into message_batches, in order
+        """
+        max_tokens = max_tokens if max_tokens is not None else self.config.get('generation', {}).get('max_tokens', 4096)
+        max_requests = max_requests if max_requests is not None else self.max_in_flight
+        expected_output = self.tokens.expected_output(max_tokens)
+        costs = [self.tokens.count_messages(messages) + expected_output for messages in message_batches]
+        return pack_waves(costs, self.token_budget, max_requests)
+    
+    def _build_request(self,
+                       messages: List[Dict[str, str]],
+                       temperature: float = None,
+                       max_tokens: int = None,
+                       top_p: float = None,
+                       json_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Build a chat completion payload, filling sampling defaults from config
+        
+        A json_schema constrains the output with VLLM's guided decoding, sent
+        in the form configured by vllm.guided_decoding.
+        """
+        generation_config = self.config.get('generation', {})
         data = {
             "model": self.model,
             "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "top_p": top_p
+            "temperature": temperature if temperature is not None else generation_config.get('temperature', 0.1),
+            "max_tokens": max_tokens if max_tokens is not None else generation_config.get('max_tokens', 4096),
+            "top_p": top_p if top_p is not None else generation_config.get('top_p', 0.95)
         }
+        if generation_config.get('seed') is not None:
+            data["seed"] = generation_config['seed']
+        if json_schema is not None and self.guided_decoding == 'response_format':
+            data["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "output", "schema": json_schema}
+            }
+        elif json_schema is not None and self.guided_decoding == 'guided_json':
+            data["guided_json"] = json_schema
+        self.reasoning.apply(data)
+        if self.streaming:
+            data["stream"] = True
+            data["stream_options"] = {"include_usage": True}
+        return data
+    
+    def _post_completion(self, data: Dict[str, Any], verbose: bool = False, **options) -> str:
+        """Send a single chat completion request, answering from the cache when possible
+        
+        Options (expect_array, max_items) are passed through to _send_once.
+        """
+        if not self.cache.enabled and not self.dedup and self.batch is None:
+            return self._send_with_retries(data, verbose, **options)
+        
+        # A capped stream returns truncated output, so the cap is part of the identity
+        key_data = data if options.get('max_items') is None else {**data, "max_items": options['max_items']}
+        key = ResponseCache.make_key(key_data)
+        if self.dedup:
+            return self.dedup.do(key, lambda: self._cached_completion(key, data, verbose, **options))
+        return self._cached_completion(key, data, verbose, **options)
+    
+    def _cached_completion(self, key: str, data: Dict[str, Any], verbose: bool = False, **options) -> str:
+        if self.batch is not None:
+            content = self.batch.lookup(key)
+            if content is not None:
+                self.cache.put(key, content)
+                self.usage.record(self.document, cached=True)
+                return content
+        
+        content = self.cache.get(key) if self.cache.enabled else None
+        if content is not None:
+            if verbose:
+                print("Using cached response")
+            self.usage.record(self.document, cached=True)
+            return content
+        
+        # The cache key doubles as the batch custom_id, so ingested results land on the same request
+        if self.batch is not None and self.batch.defer(key, data, self.document):
+            raise BatchPendingError(key)
+        
+        content = self._send_with_retries(data, verbose, **options)
+        self.cache.put(key, content)
+        return content
+    
+    def _send_with_retries(self, data: Dict[str, Any], verbose: bool = False, **options) -> str:
+        """Send a single chat completion request, retrying on transient failures
+        
+        With hedging enabled, a request slower than the configured latency
+        percentile is raced against a duplicate. A request that overruns its
+        reasoning budget is sent again with thinking off.
+        """
+        def request(payload: Dict[str, Any], signal: Optional[HedgeSignal]) -> Dict[str, Any]:
+            return self._request_with_retries(
+                "/chat/completions",
+                payload,
+                _with_message,
+                verbose,
+                signal=signal,
+                **options
+            )
         
+        def send(signal: Optional[HedgeSignal] = None):
+            result = request(data, signal)
+            if self.reasoning.overran(data, result):
+                if verbose:
+                    print(f"Reasoning ran past {self.reasoning.budget_tokens} tokens, retrying without thinking")
+                result = request(self.reasoning.without_thinking(data), signal)
+            message = result["choices"][0]["message"]
+            reasoning = reasoning_text(message)
+            if self.reasoning_log is not None and reasoning:
+                self.reasoning_log.record(
+                    self.usage.stage, self.document, reasoning, message.get("content"),
+                    _reasoning_tokens(result, self.tokens)
+                )
+            return message["content"]
+        
+        if self.hedger is None:
+            return send()
+        return self.hedger.run(self.usage.bind(send))
+    
+    def _request_with_retries(self,
+                              path: str,
+                              data: Dict[str, Any],
+                              extract: Callable[[Dict[str, Any]], Any],
+                              verbose: bool = False,
+                              signal: Optional[HedgeSignal] = None,
+                              **options) -> Any:
+        """POST a request, retrying on transient failures and malformed bodies
+        
+        extract pulls the useful part out of the response body and may raise
+        KeyError or IndexError, which are retried like network errors.
+        Backoff is exponential with jitter, and a Retry-After header on
+        429/503 responses overrides it. Other 4xx errors are not retried.
+        A hedge signal's cancel event stops the request (and its retries) at
+        the next chance. Once every endpoint's circuit is open, retrying stops.
+        
+        Raises:
+            CompletionError: If the request still fails after max_retries attempts
+            CircuitOpenError: If no endpoint is accepting requests
+        """
         for attempt in range(self.max_retries):
             try:
                 # Only print if verbose mode is enabled
-                if os.environ.get('SDK_VERBOSE', 'false').lower() == 'true':
+                if verbose:
                     print(f"Sending request to model {self.model}...")
-                response = requests.post(
-                    f"{self.api_base}/chat/completions",
-                    headers={"Content-Type": "application/json"},
+                result = self._send_once(path, data, verbose, signal=signal, **options)
+                if signal is not None and signal.is_cancelled():
+                    raise CompletionError("Request cancelled", attempts=attempt + 1)
+                return extract(result)
+            
+            except (requests.exceptions.RequestException, KeyError, IndexError) as e:
+                if signal is not None and signal.is_cancelled():
+                    raise CompletionError("Request cancelled", attempts=attempt + 1)
+                response = getattr(e, "response", None)
+                status_code = response.status_code if response is not None else None
+                retryable = status_code is None or status_code >= 500 or status_code in (408, 429)
+                if retryable and not self.endpoints.available():
+                    raise CircuitOpenError(f"Giving up after {attempt + 1} attempts, circuit open: {str(e)}")
+                if attempt == self.max_retries - 1 or not retryable:
+                    raise CompletionError(
+                        f"Failed to get completion after {attempt + 1} attempts: {str(e)}",
+                        status_code=status_code,
+                        attempts=attempt + 1
+                    )
+                delay = _retry_after(response)
+                if delay is not None:
+                    # A server asking for minutes would otherwise stall the whole run
+                    delay = min(self.max_retry_delay, delay)
+                else:
+                    delay = min(self.max_retry_delay, self.retry_delay * (2 ** attempt))
+                    delay *= random.uniform(0.5, 1.5)  # Jitter so retries from one burst spread out
+                if verbose:
+                    print(f"Request failed ({str(e)}), retrying in {delay:.1f}s")
+                if signal is not None:
+                    if signal.cancel.wait(delay):
+                        raise CompletionError("Request cancelled", attempts=attempt + 1)
+                else:
+                    time.sleep(delay)
+    
+    def _send_once(self,
+                   path: str,
+                   data: Dict[str, Any],
+                   verbose: bool = False,
+                   expect_array: bool = False,
+                   max_items: Optional[int] = None,
+                   signal: Optional[HedgeSignal] = None) -> Dict[str, Any]:
+        """POST one request to the least loaded endpoint and return the decoded JSON body
+        
+        Streamed responses are reassembled into the same shape. With
+        expect_array, a stream is cut off once its JSON array is complete or
+        max_items elements have arrived, or once a hedge signal cancels it.
+        """
+        stream = bool(data.get("stream"))
+        
+        # Wait for a concurrency slot before picking a replica so routing sees real load;
+        # hedges skip the queue since they only exist because a request is already late
+        limited = self.limiter is not None and not (signal is not None and signal.hedge)
+        if limited:
+            self.limiter.acquire()
+        try:
+            endpoint = self.endpoints.acquire()
+        except CircuitOpenError:
+            if limited:
+                self.limiter.release()
+            raise
+        if signal is not None:
+            signal.mark_sent()
+        start = time.monotonic()
+        ok = False
+        overloaded = False
+        usage = {}
+        ttft = None
+        prompts = len(data["prompt"]) if isinstance(data.get("prompt"), list) else 1
+        try:
+            try:
+                response = self.session.post(
+                    f"{endpoint.url}{path}",
                     data=json.dumps(data),
-                    timeout=180  # Increased timeout to 180 seconds
+                    timeout=self._timeout_for(data),
+                    stream=stream
                 )
-                if os.environ.get('SDK_VERBOSE', 'false').lower() == 'true':
-                    print(f"Received response with status code: {response.status_code}")
-                
-                response.raise_for_status()
-                return response.json()["choices"][0]["message"]["content"]
+            except requests.exceptions.Timeout:
+                if self.limiter:
+                    self.limiter.record_failure("timeout")
+                if self.adaptive_timeout:
+                    self.adaptive_timeout.record_timeout()
+                raise
+            if verbose:
+                print(f"Received response with status code: {response.status_code}")
             
-            except (requests.exceptions.RequestException, KeyError, IndexError) as e:
-                if attempt == self.max_retries - 1:
-                    raise Exception(f"Failed to get completion after {self.max_retries} attempts: {str(e)}")
-                time.sleep(self.retry_delay * (attempt + 1))  # Exponential backoff
+            if self.limiter and response.status_code in OVERLOAD_STATUS_CODES:
+                self.limiter.record_failure(f"status {response.status_code}")
+            
+            # Client errors are the request's fault, not the endpoint's
+            overloaded = response.status_code in OVERLOAD_STATUS_CODES
+            ok = response.status_code < 500 and not overloaded
+            response.raise_for_status()
+            if stream:
+                cancel = signal.cancel if signal is not None else None
+                result, ttft = read_chat_stream(
+                    response, start, expect_array, max_items, cancel, self.reasoning.stream_budget(data)
+                )
+            else:
+                result, ttft = response.json(), None
+            latency = time.monotonic() - start
+            usage = result.get("usage") or {}
+            estimated = not usage and stream and "messages" in data
+            if estimated:
+                # A stream cut short never gets its usage event; count what was sent and received
+                usage = self._estimate_usage(data, result)
+                self.tokens.observe(data["messages"], {"completion_tokens": usage["completion_tokens"]})
+            elif usage and "messages" in data:
+                self.tokens.observe(data["messages"], usage)
+            if self.limiter:
+                self.limiter.record_success(
+                    latency,
+                    completion_tokens=usage.get("completion_tokens"),
+                    ttft=ttft,
+                    key=(self.usage.stage, data.get("max_tokens"))
+                )
+            if self.adaptive_timeout and prompts == 1:
+                self.adaptive_timeout.observe(usage.get("completion_tokens"), latency, ttft)
+            self.usage.record(
+                self.document,
+                prompt_tokens=usage.get("prompt_tokens"),
+                completion_tokens=usage.get("completion_tokens"),
+                reasoning_tokens=_reasoning_tokens(result, self.tokens),
+                latency=latency,
+                ttft=ttft,
+                prompts=prompts,
+                estimated=estimated
+            )
+            return result
+        except Exception:
+            self.usage.record(self.document, latency=time.monotonic() - start, ok=False, prompts=prompts)
+            raise
+        finally:
+            if limited:
+                self.limiter.release()
+            self.endpoints.release(endpoint, time.monotonic() - start, ok, overloaded)
+    
+    def _estimate_usage(self, data: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, int]:
+        """Usage block for a streamed chat request, estimated from its messages and what arrived"""
+        message = (result.get("choices") or [{}])[0].get("message") or {}
+        received = (message.get("content") or "") + (reasoning_text(message) or "")
+        return {
+            "prompt_tokens": self.tokens.count_messages(data["messages"]),
+            "completion_tokens": self.tokens.count(received) if received else 0,
+        }
+    
+    def for_stage(self, stage: str) -> 'LLMClient':
+        """Client for a pipeline stage, per its profile in the `profiles` config section
+        
+        Stages without a profile, or whose profile matches this client, get
+        this client back. Other profiles get a client that shares this one's
+        HTTP session, cache, batch job and usage tracker but has its own
+        model, endpoint pool, concurrency limit and reasoning mode.
+        
+        Args:
+            stage: Profile name (generation, summary, curate or cot)
+        """
+        profile = get_stage_profile(self.config, stage)
+        api_bases = parse_api_bases(profile.get('api_base')) or self.api_bases
+        model = profile.get('model') or self.model
+        reasoning = profile.get('reasoning', self.reasoning_override)
+        control = ReasoningControl.from_config(get_vllm_config(self.config).get('reasoning'), reasoning)
+        key = (model, *control.key(), *api_bases)
+        if model == self.model and api_bases == self.api_bases and control.key() == self.reasoning.key():
+            return self
+        with self._stage_lock:
+            client = self._stage_clients.get(key)
+            if client is None:
+                client = LLMClient(
+                    config_path=self.config_path,
+                    api_base=api_bases,
+                    model_name=model,
+                    session=self.session,
+                    check_server=False,
+                    cache=self.cache,
+                    batch=self.batch,
+                    usage=self.usage,
+                    document=self.document,
+                    reasoning=reasoning,
+                    reasoning_log=self.reasoning_log,
+                    limiter=self.limiter if api_bases == self.api_bases else None
+                )
+                self._stage_clients[key] = client
+            return client
+    
+    def _timeout_for(self, data: Dict[str, Any]) -> Tuple[float, float]:
+        """(connect, read) timeouts for a request payload"""
+        if self.adaptive_timeout is None:
+            return self.timeout
+        if "messages" in data:
+            prompt_tokens = self.tokens.count_messages(data["messages"])
+        else:
+            prompts = data.get("prompt")
+            prompts = prompts if isinstance(prompts, list) else [prompts or ""]
+            prompt_tokens = sum(self.tokens.count(p) for p in prompts)
+        max_tokens = data.get("max_tokens") or self.config.get('generation', {}).get('max_tokens', 4096)
+        return self.adaptive_timeout.for_request(prompt_tokens, max_tokens, stream=bool(data.get("stream")))
+    
+    def chat_completion(self, 
+                      messages: List[Dict[str, str]], 
+                      temperature: float = None, 
+                      max_tokens: int = None,
+                      top_p: float = None,
+                      expect_array: bool = False,
+                      max_items: Optional[int] = None,
+                      json_schema: Optional[Dict[str, Any]] = None) -> str:
+        """Generate a chat completion using the VLLM OpenAI-compatible API
+        
+        When streaming is enabled and expect_array is set, generation stops as
+        soon as the JSON array in the output closes or holds max_items elements.
+        A json_schema makes the server emit only output that matches it.
+        """
+        data = self._build_request(messages, temperature, max_tokens, top_p, json_schema)
+        
+        verbose = os.environ.get('SDK_VERBOSE', 'false').lower() == 'true'
+        return self._post_completion(data, verbose, expect_array=expect_array, max_items=max_items)
+    
+    def iter_batch_completion(self, 
+                            message_batches: List[List[Dict[str, str]]], 
+                            temperature: float = None, 
+                            max_tokens: int = None,
+                            top_p: float = None,
+                            batch_size: int = None,
+                            expect_array: bool = False,
+                            max_items: Optional[int] = None,
+                            return_errors: bool = False,
+                            json_schema: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[int, Union[str, CompletionError]]]:
+        """Run message sets concurrently and yield (index, content) as each completes
+        
+        At most `batch_size` requests are in flight at any time, or as many as
+        the adaptive limiter allows when it is enabled. vLLM schedules
+        requests that arrive together into the same forward passes, so keeping
+        the window full is what actually saturates the server. Requests that
+        share leading messages are dispatched back to back so their common
+        prefix stays in VLLM's prefix cache. Closing the iterator early cancels
+        every request that has not started yet.
+        
+        A request that fails after its retries raises, or with return_errors
+        is yielded as a CompletionError so the other requests keep going.
+        CircuitOpenError always raises, since every other request would fail too.
+        """
+        batch_size = batch_size if batch_size is not None else self.max_in_flight
+        
+        verbose = os.environ.get('SDK_VERBOSE', 'false').lower() == 'true'
+        if not message_batches:
+            return
+        
+        if self.backend == 'completions' and self.batch is None:
+            yield from self._iter_multi_prompt_completion(
+                message_batches, temperature, max_tokens, top_p, batch_size, verbose, return_errors, json_schema
+            )
+            return
+        
+        # With an adaptive limiter the workers only bound the ceiling; the limiter sets the window
+        window = self.limiter.max_limit if self.limiter else batch_size
+        if verbose:
+            if self.limiter:
+                print(f"Processing {len(message_batches)} requests with adaptive concurrency ({self.limiter.describe()})")
+            else:
+                print(f"Processing {len(message_batches)} requests with up to {batch_size} in flight")
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, min(window, len(message_batches))))
+        futures = {}
+        try:
+            for index in sorted(range(len(message_batches)), key=lambda i: _prefix_key(message_batches[i])):
+                data = self._build_request(message_batches[index], temperature, max_tokens, top_p, json_schema)
+                future = executor.submit(
+                    self.usage.bind(self._post_completion), data, verbose,
+                    expect_array=expect_array, max_items=max_items
+                )
+                futures[future] = index
+            
+            for future in as_completed(futures):
+                try:
+                    content = future.result()
+                except CircuitOpenError:
+                    raise
+                except Exception as e:
+                    if not return_errors:
+                        raise Exception(f"Failed to process batch: {str(e)}")
+                    content = e if isinstance(e, CompletionError) else CompletionError(str(e))
+                yield futures[future], content
+        finally:
+            # Requests that never started are dropped; running ones finish in the background
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+            if verbose and self.limiter:
+                print(f"Adaptive concurrency: {self.limiter.describe()}")
+            if verbose and self.adaptive_timeout:
+                print(f"Adaptive timeouts: {self.adaptive_timeout.describe()}")
+            if verbose and len(self.endpoints) > 1:
+                print(f"Endpoint stats:\n{self.endpoints.describe()}")
+            if verbose and self.dedup and self.dedup.coalesced:
+                print(f"Deduplicated {self.dedup.coalesced} identical requests so far")
+    
+    def _iter_multi_prompt_completion(self,
+                                      message_batches: List[List[Dict[str, str]]],
+                                      temperature: float,
+                                      max_tokens: int,
+                                      top_p: float,
+                                      batch_size: int,
+                                      verbose: bool,
+                                      return_errors: bool = False,
+                                      json_schema: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[int, Union[str, CompletionError]]]:
+        """Send message sets to /completions with many prompts per HTTP request
+        
+        Chat templates are applied locally, cached prompts are answered
+        directly, and the remaining prompts go out in groups of
+        multi_prompt_size. Each choice's index maps it back to its prompt.
+        """
+        base = self._build_request([], temperature, max_tokens, top_p, json_schema)
+        for field in ("messages", "stream", "stream_options", "chat_template_kwargs"):
+            base.pop(field, None)
+        template_kwargs = self.reasoning.template_kwargs()
+        
+        pending = []
+        for index, messages in enumerate(message_batches):
+            prompt = self.chat_tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True, **template_kwargs
+            )
+            key = ResponseCache.make_key({**base, "prompt": prompt})
+            content = self.cache.get(key) if self.cache.enabled else None
+            if content is not None:
+                self.usage.record(self.document, cached=True)
+                yield index, content
+            else:
+                pending.append((index, prompt, key))
+        if not pending:
+            return
+        
+        groups = [pending[i:i + self.multi_prompt_size] for i in range(0, len(pending), self.multi_prompt_size)]
+        if verbose:
+            print(f"Sending {len(pending)} prompts to /completions in {len(groups)} multi-prompt requests")
+        
+        def send_group(group):
+            data = {**base, "prompt": [prompt for _, prompt, _ in group]}
+            return self._request_with_retries(
+                "/completions",
+                data,
+                lambda result: _choices_by_index(result, len(group)),
+                verbose
+            )
+        
+        workers = max(1, min(len(groups), batch_size // self.multi_prompt_size or 1))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {executor.submit(self.usage.bind(send_group), group): group for group in groups}
+        try:
+            for future in as_completed(futures):
+                try:
+                    texts = future.result()
+                except CircuitOpenError:
+                    raise
+                except Exception as e:
+                    if not return_errors:
+                        raise Exception(f"Failed to process batch: {str(e)}")
+                    error = e if isinstance(e, CompletionError) else CompletionError(str(e))
+                    for index, _, _ in futures[future]:
+                        yield index, error
+                    continue
+                for (index, _, key), text in zip(futures[future], texts):
+                    if self.cache.enabled:
+                        self.cache.put(key, text)
+                    yield index, text
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
     
     def batch_completion(self, 
                        message_batches: List[List[Dict[str, str]]], 
                        temperature: float = None, 
                        max_tokens: int = None,
                        top_p: float = None,
-                       batch_size: int = None) -> List[str]:
-        """Process multiple message sets in batches
+                       batch_size: int = None,
+                       expect_array: bool = False,
+                       max_items: Optional[int] = None,
+                       return_errors: bool = False,
+                       json_schema: Optional[Dict[str, Any]] = None) -> List[Union[str, CompletionError]]:
+        """Process multiple message sets concurrently
         
-        Instead of sending requests one at a time, this method processes
-        multiple prompts in batches to maximize throughput. It uses VLLM's
-        ability to efficiently batch requests.
+        Keeps up to `batch_size` requests (or the adaptive limit) in flight against the VLLM server
+        and returns the responses in the same order as `message_batches`.
+        Every request retries on its own, so one failure never discards the
+        others: with return_errors the failed slots hold a CompletionError,
+        otherwise a BatchCompletionError carrying the partial results is raised
+        once the whole batch has finished.
         """
-        # Get defaults from config if not provided
-        generation_config = self.config.get('generation', {})
-        temperature = temperature if temperature is not None else generation_config.get('temperature', 0.1)
-        max_tokens = max_tokens if max_tokens is not None else generation_config.get('max_tokens', 4096)
-        top_p = top_p if top_p is not None else generation_config.get('top_p', 0.95)
-        batch_size = batch_size if batch_size is not None else generation_config.get('batch_size', 32)
+        results: List[Union[str, CompletionError, None]] = [None] * len(message_batches)
+        for index, content in self.iter_batch_completion(
+            message_batches,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            batch_size=batch_size,
+            expect_array=expect_array,
+            max_items=max_items,
+            return_errors=True,
+            json_schema=json_schema
+        ):
+            results[index] = content
         
-        verbose = os.environ.get('SDK_VERBOSE', 'false').lower() == 'true'
-        results = []
+        if not return_errors and any(isinstance(r, CompletionError) for r in results):
+            raise BatchCompletionError(results)
+        return results
+    
+    def retry_failed(self,
+                     message_batches: List[List[Dict[str, str]]],
+                     results: List[Union[str, CompletionError]],
+                     **kwargs) -> List[Union[str, CompletionError]]:
+        """Re-submit only the slots of a batch_completion result that hold errors
         
-        # Process message batches in chunks to avoid overloading the server
-        for i in range(0, len(message_batches), batch_size):
-            batch_chunk = message_batches[i:i+batch_size]
-            if verbose:
-                print(f"Processing batch {i//batch_size + 1}/{(len(message_batches) + batch_size - 1) // batch_size} with {len(batch_chunk)} requests")
-            
-            # Create batch request payload for VLLM
-            batch_requests = []
-            for messages in batch_chunk:
-                batch_requests.append({
-                    "model": self.model,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                    "top_p": top_p
-                })
-            
-            try:
-                # For now, we run these in parallel with multiple requests
-                batch_results = []
-                for request_data in batch_requests:
-                    # Only print if verbose mode is enabled
-                    if verbose:
-                        print(f"Sending batch request to model {self.model}...")
-                    
-                    response = requests.post(
-                        f"{self.api_base}/chat/completions",
-                        headers={"Content-Type": "application/json"},
-                        data=json.dumps(request_data),
-                        timeout=180  # Increased timeout for batch processing
-                    )
-                    
-                    if verbose:
-                        print(f"Received response with status code: {response.status_code}")
-                    
-                    response.raise_for_status()
-                    content = response.json()["choices"][0]["message"]["content"]
-                    batch_results.append(content)
-                
-                results.extend(batch_results)
-                
-            except (requests.exceptions.RequestException, KeyError, IndexError) as e:
-                raise Exception(f"Failed to process batch: {str(e)}")
+        Args:
+            message_batches: The message sets originally passed to batch_completion
+            results: Its results, as returned with return_errors=True
+            **kwargs: Sampling options forwarded to batch_completion
             
-            time.sleep(0.1)
-        
+        Returns:
+            The results with every slot that succeeded on resubmission filled in
+        """
+        failed = [i for i, r in enumerate(results)
+                  if isinstance(r, CompletionError) and not isinstance(r, BatchPendingError)]
+        if not failed:
+            return results
+        if os.environ.get('SDK_VERBOSE', 'false').lower() == 'true':
+            print(f"Re-submitting {len(failed)} failed requests")
+        kwargs["return_errors"] = True
+        retried = self.batch_completion([message_batches[i] for i in failed], **kwargs)
+        results = list(results)
+        for index, result in zip(failed, retried):
+            results[index] = result
         return results
     
+    def prefix_cache_monitor(self) -> PrefixCacheMonitor:
+        """Monitor that reports VLLM prefix cache hits across this client's endpoints"""
+        return PrefixCacheMonitor(
+            self.session,
+            [endpoint.url for endpoint in self.endpoints.endpoints],
+            self.timeout[0]
+        )
+    
+    def close(self):
+        """Stop background health checks and hedging threads, including those of stage clients"""
+        self.endpoints.close()
+        if self.hedger is not None:
+            self.hedger.close()
+        for client in self._stage_clients.values():
+            client.close()
+    
     @classmethod
     def from_config(cls, config_path: Path) -> 'LLMClient':
         """Create a client from configuration file"""
-        return cls(config_path=config_path)
\ No newline at end of file
+        return cls(config_path=config_path)
+
+
+def _retry_after(response: Optional[requests.Response]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header on a 429/503 response"""
+    if response is None or response.status_code not in OVERLOAD_STATUS_CODES:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _with_message(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The response body, once it is known to hold a message (KeyError/IndexError otherwise)"""
+    result["choices"][0]["message"]
+    return result
+
+
+def _reasoning_tokens(result: Dict[str, Any], tokens: TokenEstimator) -> Optional[int]:
+    """Reasoning tokens from the usage block, or estimated from the reasoning text"""
+    details = (result.get("usage") or {}).get("completion_tokens_details") or {}
+    if details.get("reasoning_tokens") is not None:
+        return details["reasoning_tokens"]
+    texts = [reasoning_text(choice.get("message") or {}) for choice in result.get("choices") or []]
+    texts = [text for text in texts if text]
+    return sum(tokens.count(text) for text in texts) if texts else None
+
+
+def _prefix_key(messages: List[Dict[str, str]]) -> str:
+    """Everything but the final message, which carries the variable content"""
+    return "\x00".join(message.get("content") or "" for message in messages[:-1])
+
+
+def _choices_by_index(result: Dict[str, Any], count: int) -> List[str]:
+    """Order the choices of a multi-prompt /completions response by prompt index"""
+    texts: List[Optional[str]] = [None] * count
+    for choice in result["choices"]:
+        texts[choice["index"]] = choice["text"]
+    if any(text is None for text in texts):
+        raise KeyError(f"Expected {count} choices, got {len(result['choices'])}")
+    return texts
\ No newline at end of file
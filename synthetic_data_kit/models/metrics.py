@@ -0,0 +1,89 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Read prefix cache counters from VLLM's Prometheus /metrics endpoint
+import re
+from typing import Dict, List, Optional
+
+import requests
+
+# vLLM V1 exports token counters; older engines only export a hit-rate gauge
+QUERIES_METRIC = "vllm:prefix_cache_queries_total"
+HITS_METRIC = "vllm:prefix_cache_hits_total"
+HIT_RATE_METRIC = "vllm:gpu_prefix_cache_hit_rate"
+
+_SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{[^}]*\})?\s+([0-9.eE+-]+|NaN)\s*$')
+
+
+def metrics_url(api_base: str) -> str:
+    """/metrics is served at the server root, not under /v1"""
+    root = api_base.rstrip("/")
+    if root.endswith("/v1"):
+        root = root[:-len("/v1")]
+    return f"{root}/metrics"
+
+
+def scrape_prefix_cache(session: requests.Session, api_base: str, timeout: float = 5.0) -> Optional[Dict[str, float]]:
+    """Sum prefix cache counters across all series, or None if the endpoint is unavailable"""
+    try:
+        response = session.get(metrics_url(api_base), timeout=timeout)
+        if response.status_code != 200:
+            return None
+    except requests.exceptions.RequestException:
+        return None
+
+    totals: Dict[str, float] = {}
+    for line in response.text.splitlines():
+        match = _SAMPLE_PATTERN.match(line)
+        if not match or match.group(2) == "NaN":
+            continue
+        name = match.group(1)
+        if name in (QUERIES_METRIC, HITS_METRIC, HIT_RATE_METRIC):
+            totals[name] = totals.get(name, 0.0) + float(match.group(2))
+    return totals
+
+
+class PrefixCacheMonitor:
+    """Measure prefix cache hits on the server(s) between start() and report()"""
+
+    def __init__(self, session: requests.Session, api_bases: List[str], timeout: float = 5.0):
+        self.session = session
+        self.api_bases = api_bases
+        self.timeout = timeout
+        self._start: Dict[str, Optional[Dict[str, float]]] = {}
+
+    def start(self):
+        self._start = {url: scrape_prefix_cache(self.session, url, self.timeout) for url in self.api_bases}
+
+    def report(self) -> Optional[Dict[str, float]]:
+        """Prefix cache queries, hits and hit rate since start(), or None if not exported"""
+        queries = hits = 0.0
+        rates = []
+        found = False
+        for url in self.api_bases:
+            before = self._start.get(url)
+            after = scrape_prefix_cache(self.session, url, self.timeout)
+            if not before or not after:
+                continue
+            if QUERIES_METRIC in after and HITS_METRIC in after:
+                queries += after[QUERIES_METRIC] - before.get(QUERIES_METRIC, 0.0)
+                hits += after[HITS_METRIC] - before.get(HITS_METRIC, 0.0)
+                found = True
+            elif HIT_RATE_METRIC in after:
+                rates.append(after[HIT_RATE_METRIC])
+        if found:
+            return {"queries": queries, "hits": hits, "hit_rate": hits / queries if queries else 0.0}
+        if rates:
+            return {"hit_rate": sum(rates) / len(rates)}
+        return None
+
+    def describe(self) -> Optional[str]:
+        stats = self.report()
+        if stats is None or stats.get("queries") == 0:
+            return None
+        if "queries" in stats:
+            return (f"Prefix cache hit rate: {stats['hit_rate']:.1%} "
+                    f"({int(stats['hits'])} of {int(stats['queries'])} prompt tokens)")
+        return f"Prefix cache hit rate: {stats['hit_rate']:.1%}"
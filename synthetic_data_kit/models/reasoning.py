@@ -0,0 +1,144 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Thinking control for reasoning models served with a VLLM reasoning parser
+import json
+import os
+import threading
+from typing import Dict, Any, Optional, Union
+
+REASONING_MODES = ("off", "budget", "on")
+
+
+def _mode(value: Any) -> str:
+    # YAML reads bare on/off as booleans
+    if value is True:
+        return "on"
+    if value is False:
+        return "off"
+    mode = str(value or "on").lower()
+    if mode not in REASONING_MODES:
+        raise ValueError(f"Unknown reasoning mode: {value} (expected one of {', '.join(REASONING_MODES)})")
+    return mode
+
+
+def reasoning_text(message: Dict[str, Any]) -> Optional[str]:
+    """Reasoning split off by the server's reasoning parser, if any"""
+    return message.get("reasoning_content") or message.get("reasoning")
+
+
+class ReasoningControl:
+    """Turn a model's thinking off, cap it, or leave it on
+
+    "off" sets the chat template flag that disables thinking (Qwen3's
+    enable_thinking). "on" leaves requests untouched. "budget" keeps
+    thinking on, raises max_tokens by the budget so thinking does not eat
+    the answer's share, and when the thinking alone runs past the budget
+    (the stream is cut there; without streaming, the output ends before
+    any answer) the request is sent again with thinking off.
+    """
+
+    def __init__(self, mode: str = "on", budget_tokens: int = 1024, template_flag: str = "enable_thinking"):
+        self.mode = _mode(mode)
+        self.budget_tokens = budget_tokens
+        self.template_flag = template_flag
+        self.overruns = 0
+
+    @classmethod
+    def from_config(cls,
+                    settings: Optional[Union[str, bool, Dict[str, Any]]],
+                    override: Optional[Union[str, bool, Dict[str, Any]]] = None) -> 'ReasoningControl':
+        """Build from the vllm `reasoning` block, with a stage profile's `reasoning` on top
+
+        Either may be a mode on its own ("off") or a block with mode and budget_tokens.
+        """
+        merged: Dict[str, Any] = {}
+        for value in (settings, override):
+            if isinstance(value, dict):
+                merged.update(value)
+            elif value is not None:
+                merged["mode"] = value
+        return cls(
+            mode=merged.get("mode", "on"),
+            budget_tokens=merged.get("budget_tokens", 1024),
+            template_flag=merged.get("template_flag", "enable_thinking"),
+        )
+
+    def key(self) -> tuple:
+        return (self.mode, self.budget_tokens, self.template_flag)
+
+    def template_kwargs(self, thinking: Optional[bool] = None) -> Dict[str, Any]:
+        """Chat template arguments for this mode, or to force thinking on or off"""
+        if thinking is None:
+            if self.mode == "on":
+                return {}
+            thinking = self.mode == "budget"
+        return {self.template_flag: thinking}
+
+    def apply(self, data: Dict[str, Any]):
+        """Add the mode's template flag and budget to a chat completion payload"""
+        kwargs = self.template_kwargs()
+        if kwargs:
+            data["chat_template_kwargs"] = {**data.get("chat_template_kwargs", {}), **kwargs}
+        if self.mode == "budget" and data.get("max_tokens"):
+            data["max_tokens"] += self.budget_tokens
+
+    def stream_budget(self, data: Dict[str, Any]) -> Optional[int]:
+        """Reasoning tokens a streamed request may produce before it is cut off"""
+        if self.mode != "budget" or not (data.get("chat_template_kwargs") or {}).get(self.template_flag):
+            return None
+        return self.budget_tokens
+
+    def overran(self, data: Dict[str, Any], result: Dict[str, Any]) -> bool:
+        """True if a budgeted request spent its output on thinking and never answered"""
+        if self.stream_budget(data) is None:
+            return False
+        choice = result["choices"][0]
+        if result.get("reasoning_truncated"):
+            return True
+        return not choice["message"].get("content") and choice.get("finish_reason") == "length"
+
+    def without_thinking(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """The payload to resend after an overrun: same request, thinking off"""
+        retry = dict(data)
+        retry["chat_template_kwargs"] = {**data.get("chat_template_kwargs", {}), self.template_flag: False}
+        retry["max_tokens"] = data["max_tokens"] - self.budget_tokens
+        self.overruns += 1
+        return retry
+
+    def describe(self) -> str:
+        if self.mode == "budget":
+            return f"Reasoning budget {self.budget_tokens} tokens, {self.overruns} requests reissued without thinking"
+        return f"Reasoning {self.mode}"
+
+
+class ReasoningLog:
+    """Append each call's reasoning to a JSONL file, separate from the generated outputs"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self,
+               stage: str,
+               document: Optional[str],
+               reasoning: str,
+               content: Optional[str],
+               reasoning_tokens: Optional[int] = None):
+        line = json.dumps({
+            "stage": stage,
+            "document": document,
+            "reasoning_tokens": reasoning_tokens,
+            "reasoning": reasoning,
+            "content": content,
+        })
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+            self.count += 1
@@ -0,0 +1,120 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Shared HTTP session for talking to VLLM servers
+import threading
+from typing import Dict, Any, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def build_session(vllm_config: Dict[str, Any]) -> requests.Session:
+    """Create a keep-alive session with a connection pool sized for concurrent requests
+
+    Retries are handled by LLMClient, so the adapter itself never retries.
+    """
+    pool_size = vllm_config.get('pool_size', 64)
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+def get_timeouts(vllm_config: Dict[str, Any]) -> Tuple[float, float]:
+    """Get (connect, read) timeouts in seconds from the VLLM config"""
+    return (
+        vllm_config.get('connect_timeout', 5.0),
+        vllm_config.get('request_timeout', 180.0),
+    )
+
+
+class AdaptiveTimeout:
+    """Size each request's read timeout from the work it asks for
+
+    The expected duration is prompt prefill plus max_tokens at the decode
+    speed recently observed per request, scaled by a safety factor and
+    clamped between a floor and a ceiling. A streamed response only needs
+    its first token and each later chunk to arrive in time, so its read
+    timeout covers prefill plus a stall allowance instead.
+    """
+
+    def __init__(self,
+                 connect_timeout: float = 5.0,
+                 floor: float = 15.0,
+                 ceiling: float = 900.0,
+                 safety_factor: float = 3.0,
+                 tokens_per_second: float = 15.0,
+                 prefill_tokens_per_second: float = 2000.0,
+                 stall_timeout: float = 60.0):
+        """Initialize the timeout model
+
+        Args:
+            connect_timeout: Seconds to wait for a connection
+            floor: Shortest read timeout ever used
+            ceiling: Longest read timeout ever used
+            safety_factor: Multiple of the expected duration to allow
+            tokens_per_second: Decode speed per request assumed before any is observed
+            prefill_tokens_per_second: Prompt processing speed per request
+            stall_timeout: Seconds a stream may go without data after its first token
+        """
+        self.connect_timeout = connect_timeout
+        self.floor = floor
+        self.ceiling = ceiling
+        self.safety_factor = safety_factor
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.stall_timeout = stall_timeout
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, vllm_config: Dict[str, Any]) -> Optional['AdaptiveTimeout']:
+        """Build from the `adaptive_timeout` block of the VLLM config, or None if disabled"""
+        settings = vllm_config.get('adaptive_timeout') or {}
+        if not settings.get('enabled', False):
+            return None
+        return cls(
+            connect_timeout=vllm_config.get('connect_timeout', 5.0),
+            floor=settings.get('floor', 15.0),
+            ceiling=settings.get('ceiling', vllm_config.get('request_timeout', 900.0)),
+            safety_factor=settings.get('safety_factor', 3.0),
+            tokens_per_second=settings.get('initial_tokens_per_second', 15.0),
+            prefill_tokens_per_second=settings.get('prefill_tokens_per_second', 2000.0),
+            stall_timeout=settings.get('stall_timeout', 60.0),
+        )
+
+    def for_request(self, prompt_tokens: int, max_tokens: int, stream: bool = False) -> Tuple[float, float]:
+        """(connect, read) timeouts for a request"""
+        prefill = prompt_tokens / self.prefill_tokens_per_second
+        if stream:
+            expected = prefill + self.stall_timeout
+        else:
+            expected = prefill + max_tokens / self.tokens_per_second
+        read = min(self.ceiling, max(self.floor, expected * self.safety_factor))
+        return self.connect_timeout, read
+
+    def observe(self, completion_tokens: Optional[int], latency: float, ttft: Optional[float] = None):
+        """Update the decode speed estimate from a completed request"""
+        # Very short outputs are dominated by queueing and prefill, not decode speed
+        if not completion_tokens or completion_tokens < 16:
+            return
+        decode_time = latency - ttft if ttft is not None else latency
+        if decode_time <= 0:
+            return
+        rate = completion_tokens / decode_time
+        with self._lock:
+            self.tokens_per_second = 0.8 * self.tokens_per_second + 0.2 * rate
+
+    def record_timeout(self):
+        """A request timed out: assume the server got slower so the retry gets longer"""
+        with self._lock:
+            self.timeouts += 1
+            self.tokens_per_second *= 0.5
+
+    def describe(self) -> str:
+        return f"decode speed ~{self.tokens_per_second:.1f} tokens/s per request, {self.timeouts} timeouts"
@@ -0,0 +1,92 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Server-sent event handling for streamed chat completions
+import json
+import threading
+import time
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+import requests
+
+from synthetic_data_kit.utils.llm_processing import IncrementalJSONArrayParser
+
+
+def iter_stream_events(response: requests.Response) -> Iterator[Dict[str, Any]]:
+    """Yield the decoded JSON payload of each `data:` event until [DONE]"""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            return
+        yield json.loads(payload)
+
+
+def read_chat_stream(response: requests.Response,
+                     start: float,
+                     expect_array: bool = False,
+                     max_items: Optional[int] = None,
+                     cancel: Optional[threading.Event] = None,
+                     reasoning_budget: Optional[int] = None) -> Tuple[Dict[str, Any], Optional[float]]:
+    """Consume a streamed chat completion and rebuild a non-streamed response body
+
+    When expect_array is set, the stream is closed as soon as the JSON array in
+    the output is complete or max_items elements have been parsed; closing the
+    connection makes VLLM abort the request so no more tokens are decoded.
+    Setting cancel (e.g. when a hedged duplicate has won) closes it the same way.
+    With reasoning_budget, a stream still thinking after that many reasoning
+    deltas (about one token each) is closed and marked reasoning_truncated.
+
+    Returns:
+        The response body in `/chat/completions` shape and the time to first token
+    """
+    parser = IncrementalJSONArrayParser() if expect_array else None
+    content = []
+    reasoning = []
+    usage = None
+    ttft = None
+    stopped_early = False
+    truncated = False
+
+    try:
+        for event in iter_stream_events(response):
+            if cancel is not None and cancel.is_set():
+                break
+            if event.get("usage"):
+                usage = event["usage"]
+            for choice in event.get("choices") or []:
+                delta = choice.get("delta") or {}
+                thought = delta.get("reasoning_content") or delta.get("reasoning")
+                if thought:
+                    reasoning.append(thought)
+                text = delta.get("content")
+                if not text:
+                    continue
+                if ttft is None:
+                    ttft = time.monotonic() - start
+                content.append(text)
+                if parser is not None:
+                    parser.feed(text)
+            if parser is not None and (
+                parser.closed or (max_items is not None and len(parser.items) >= max_items)
+            ):
+                stopped_early = True
+                break
+            if reasoning_budget is not None and not content and len(reasoning) > reasoning_budget:
+                truncated = True
+                break
+    finally:
+        response.close()
+
+    message = {"content": parser.text() if stopped_early else "".join(content)}
+    if reasoning:
+        message["reasoning_content"] = "".join(reasoning)
+    body = {"choices": [{"message": message}]}
+    if truncated:
+        body["reasoning_truncated"] = True
+    if usage is not None:
+        body["usage"] = usage
+    return body, ttft
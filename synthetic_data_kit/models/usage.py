@@ -0,0 +1,160 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Token usage, latency and throughput accounting per pipeline stage
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+UNTAGGED_STAGE = "other"
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class UsageTracker:
+    """Record the usage block, latency and time to first token of every LLM call
+
+    Calls are tagged with the stage set by scope() on the calling thread
+    (bind() carries the tag into worker threads) and the client's document.
+    """
+
+    def __init__(self):
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def scope(self, stage: str) -> Iterator[None]:
+        """Tag every call made on this thread inside the block with stage"""
+        previous = getattr(self._local, "stage", None)
+        self._local.stage = stage
+        try:
+            yield
+        finally:
+            self._local.stage = previous
+
+    @property
+    def stage(self) -> str:
+        return getattr(self._local, "stage", None) or UNTAGGED_STAGE
+
+    def bind(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """Wrap fn so it runs under the calling thread's stage, e.g. in an executor"""
+        stage = getattr(self._local, "stage", None)
+
+        def bound(*args, **kwargs):
+            with self.scope(stage):
+                return fn(*args, **kwargs)
+        return bound
+
+    def record(self,
+               document: Optional[str] = None,
+               prompt_tokens: Optional[int] = None,
+               completion_tokens: Optional[int] = None,
+               reasoning_tokens: Optional[int] = None,
+               latency: Optional[float] = None,
+               ttft: Optional[float] = None,
+               ok: bool = True,
+               cached: bool = False,
+               prompts: int = 1,
+               estimated: bool = False):
+        """Record one call
+
+        Args:
+            document: Document the call was made for
+            prompt_tokens: Prompt tokens reported by the server
+            completion_tokens: Completion tokens reported by the server
+            reasoning_tokens: Part of the completion spent thinking (reported, or estimated from the reasoning text)
+            latency: Seconds from sending the request to the end of the response
+            ttft: Seconds to the first content token (streamed requests only)
+            ok: False if the request failed
+            cached: True if the answer came from the response cache or batch results
+            prompts: Number of prompts the call carried (multi-prompt requests)
+            estimated: True if the token counts are local estimates (a stream cut short before its usage event)
+        """
+        call = {
+            "stage": self.stage,
+            "document": document,
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "reasoning_tokens": reasoning_tokens or 0,
+            "latency": latency,
+            "ttft": ttft,
+            "ok": ok,
+            "cached": cached,
+            "prompts": prompts,
+            "estimated": estimated,
+            "end": time.time(),
+        }
+        with self._lock:
+            self.calls.append(call)
+
+    def _aggregate(self, calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+        sent = [c for c in calls if not c["cached"]]
+        latencies = [c["latency"] for c in sent if c["ok"] and c["latency"] is not None]
+        ttfts = [c["ttft"] for c in sent if c["ttft"] is not None]
+        prompt_tokens = sum(c["prompt_tokens"] for c in sent)
+        completion_tokens = sum(c["completion_tokens"] for c in sent)
+        busy = sum(latencies)
+        wall = None
+        if latencies:
+            wall = max(c["end"] for c in sent) - min(c["end"] - (c["latency"] or 0.0) for c in sent)
+        return {
+            "requests": sum(c["prompts"] for c in sent),
+            "failed": sum(c["prompts"] for c in sent if not c["ok"]),
+            "cached": sum(c["prompts"] for c in calls if c["cached"]),
+            "estimated": sum(c["prompts"] for c in sent if c.get("estimated")),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "reasoning_tokens": sum(c["reasoning_tokens"] for c in sent),
+            "mean_latency": round(busy / len(latencies), 3) if latencies else None,
+            "p95_latency": round(_percentile(latencies, 0.95), 3) if latencies else None,
+            "mean_ttft": round(sum(ttfts) / len(ttfts), 3) if ttfts else None,
+            # Decode speed seen by a single request vs. tokens delivered per second of wall time
+            "tokens_per_second_per_request": round(completion_tokens / busy, 1) if busy else None,
+            "tokens_per_second": round(completion_tokens / wall, 1) if wall else None,
+            "wall_time": round(wall, 3) if wall is not None else None,
+        }
+
+    def _group(self, field: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            calls = list(self.calls)
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for call in calls:
+            groups.setdefault(call[field] or "-", []).append(call)
+        return {name: self._aggregate(group) for name, group in groups.items()}
+
+    def by_stage(self) -> Dict[str, Dict[str, Any]]:
+        return self._group("stage")
+
+    def by_document(self) -> Dict[str, Dict[str, Any]]:
+        return self._group("document")
+
+    def total(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self.calls)
+        return self._aggregate(calls)
+
+    def report(self) -> Dict[str, Any]:
+        """JSON-serializable report with totals, per-stage and per-document breakdowns"""
+        return {
+            "total": self.total(),
+            "stages": self.by_stage(),
+            "documents": self.by_document(),
+        }
+
+    def save(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
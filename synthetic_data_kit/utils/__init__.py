@@ -11,7 +11,9 @@ from synthetic_data_kit.utils.config import (
     get_generation_config,
     get_curate_config,
     get_format_config,
+    get_stage_profile,
     get_prompt,
+    build_prompt_messages,
     merge_configs,
 )
 from synthetic_data_kit.utils.text import split_into_chunks, extract_json_from_text
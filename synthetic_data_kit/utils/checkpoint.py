@@ -0,0 +1,96 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Per-chunk checkpoints so interrupted generation resumes where it stopped
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Any, List, Optional
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def request_key(payload: Dict[str, Any]) -> str:
+    """Stable key for everything that shapes a chunk's result"""
+    return text_hash(json.dumps(payload, sort_keys=True, default=str))
+
+
+class ChunkCheckpoint:
+    """Append-only JSONL of finished chunks for one document
+
+    The file is named by the document's output name and text, so two
+    copies of one document in a corpus never share a checkpoint. Each line
+    holds a chunk index, a key for that chunk's request and its results.
+    A line only counts on a rerun if the chunk's request is still the same
+    (its text, prompt, model, sampling settings and pairs per chunk all
+    go into the key), so changing any of them never reuses stale results.
+    A line cut short by a crash is ignored.
+    """
+
+    def __init__(self, path: str, document_hash: str):
+        self.path = path
+        self.document_hash = document_hash
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_document(cls,
+                     directory: Optional[str],
+                     document_text: str,
+                     name: Optional[str] = None) -> Optional['ChunkCheckpoint']:
+        """Checkpoint for a document in directory, or None if checkpointing is off
+
+        Args:
+            directory: Checkpoint directory (generation.checkpoint_dir)
+            document_text: Full text of the document
+            name: Name the document's output is written under
+        """
+        if not directory:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        document_hash = text_hash(f"{name or ''}\0{document_text}")
+        return cls(os.path.join(directory, f"{document_hash[:32]}.jsonl"), document_hash)
+
+    def load(self, chunk_keys: List[str]) -> Dict[int, Any]:
+        """Results of the chunks already finished, by chunk index
+
+        Args:
+            chunk_keys: Key of each chunk's request (see request_key), by chunk index
+        """
+        done: Dict[int, Any] = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    index = record["chunk"]
+                    if record["document"] == self.document_hash and record["request"] == chunk_keys[index]:
+                        done[index] = record["result"]
+                except (ValueError, KeyError, IndexError, TypeError):
+                    continue
+        return done
+
+    def append(self, index: int, chunk_key: str, result: Any):
+        """Record a finished chunk, flushed to disk before returning"""
+        line = json.dumps({
+            "document": self.document_hash,
+            "chunk": index,
+            "request": chunk_key,
+            "result": result,
+        })
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self):
+        """Delete the checkpoint once the document's output has been written"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
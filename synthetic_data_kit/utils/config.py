@@ -6,8 +6,9 @@
 # Config Utilities
 import yaml
 import os
+import string
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Set
 
 # Default config location relative to the package (original)
 ORIGINAL_CONFIG_PATH = os.path.abspath(
@@ -67,7 +68,13 @@ def get_vllm_config(config: Dict[str, Any]) -> Dict[str, Any]:
         'port': 8000,
         'model': 'meta-llama/Llama-3.3-70B-Instruct',
         'max_retries': 3,
-        'retry_delay': 1.0
+        'retry_delay': 1.0,
+        'max_in_flight': 32,
+        'pool_size': 64,
+        'connect_timeout': 5.0,
+        'request_timeout': 180.0,
+        'dedup_requests': True,
+        'guided_decoding': 'response_format'
     })
 
 def get_generation_config(config: Dict[str, Any]) -> Dict[str, Any]:
@@ -96,6 +103,10 @@ def get_format_config(config: Dict[str, Any]) -> Dict[str, Any]:
         'pretty_json': True
     })
 
+def get_stage_profile(config: Dict[str, Any], stage: str) -> Dict[str, Any]:
+    """Get the model/endpoint overrides for a pipeline stage (generation, summary, curate, cot)"""
+    return (config.get('profiles') or {}).get(stage) or {}
+
 def get_prompt(config: Dict[str, Any], prompt_name: str) -> str:
     """Get prompt by name"""
     prompts = config.get('prompts', {})
@@ -103,6 +114,39 @@ def get_prompt(config: Dict[str, Any], prompt_name: str) -> str:
         raise ValueError(f"Prompt '{prompt_name}' not found in configuration")
     return prompts[prompt_name]
 
+def prompt_fields(template: str) -> Set[str]:
+    """Names of the {placeholders} a prompt template fills in (escaped {{braces}} excluded)"""
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field}
+
+def build_prompt_messages(template: str, variable: str, **values) -> List[Dict[str, str]]:
+    """Format a prompt as a static system message followed by a variable user message
+    
+    Everything before the line holding `{variable}` (and the label line just
+    above it, such as "Text:") goes in the system message, so requests that
+    share instructions share a token prefix VLLM can cache. The rest, with
+    the variable content, goes in the user message.
+    """
+    marker = "{" + variable + "}"
+    index = template.find(marker)
+    if index == -1:
+        return [{"role": "system", "content": template.format(**values)}]
+    
+    split = template.rfind("\n", 0, index) + 1
+    if not template[split:index].strip():
+        # The variable sits on its own line; keep its label with it
+        label_start = template.rfind("\n", 0, max(split - 1, 0)) + 1
+        if template[label_start:split].strip().endswith(":"):
+            split = label_start
+    
+    system = template[:split].format(**values).strip()
+    user = template[split:].format(**values).strip()
+    if not system:
+        return [{"role": "user", "content": user}]
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user}
+    ]
+
 def merge_configs(base_config: Dict[str, Any], override_config: Dict[str, Any]) -> Dict[str, Any]:
     """Merge two configuration dictionaries"""
     result = base_config.copy()
@@ -268,6 +268,86 @@ def parse_ratings(text: str, original_items: List[Dict[str, str]] = None) -> Lis
     error_snippet = text[:100] if len(text) > 100 else text
     raise ValueError(f"Could not parse JSON with ratings: {error_snippet}")
 
+class IncrementalJSONArrayParser:
+    """Parse a JSON array out of streamed LLM output one element at a time
+    
+    Text before the first '[' is skipped. Each top-level element is decoded as
+    soon as its closing bracket arrives, and `closed` flips once the array
+    ends, so callers can stop generation without waiting for trailing text.
+    Output that starts with an object instead of an array is left alone.
+    """
+    
+    def __init__(self):
+        self.buffer = ""
+        self.items: List[Any] = []
+        self.started = False
+        self.closed = False
+        self.disabled = False
+        self.end = None  # Index in buffer just past the closing ']'
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item_start = None
+        self._last_item_end = None
+    
+    def feed(self, text: str) -> List[Any]:
+        """Add streamed text and return any elements completed by it"""
+        self.buffer += text
+        new_items = []
+        if self.closed or self.disabled:
+            return new_items
+        
+        while self._pos < len(self.buffer):
+            char = self.buffer[self._pos]
+            if not self.started:
+                if char == '[':
+                    self.started = True
+                    self._depth = 1
+                elif char == '{':
+                    self.disabled = True
+                    return new_items
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '[{':
+                if self._depth == 1:
+                    self._item_start = self._pos
+                self._depth += 1
+            elif char in ']}':
+                self._depth -= 1
+                if self._depth == 1 and self._item_start is not None:
+                    item_text = self.buffer[self._item_start:self._pos + 1]
+                    self._item_start = None
+                    self._last_item_end = self._pos + 1
+                    try:
+                        item = json.loads(re.sub(r',(\s*\}|\s*\])', r'\1', item_text))
+                        self.items.append(item)
+                        new_items.append(item)
+                    except json.JSONDecodeError:
+                        pass
+                elif self._depth == 0:
+                    self.closed = True
+                    self.end = self._pos + 1
+                    self._pos += 1
+                    return new_items
+            self._pos += 1
+        return new_items
+    
+    def text(self) -> str:
+        """The output up to the end of the array, closing it after the last complete element if needed"""
+        if self.closed:
+            return self.buffer[:self.end]
+        if self._last_item_end is not None:
+            return self.buffer[:self._last_item_end] + "]"
+        return self.buffer
+
 def convert_to_conversation_format(qa_pairs: List[Dict[str, str]], 
                                  system_prompt: Optional[str] = None) -> List[List[Dict[str, str]]]:
     """Convert QA pairs to conversation format"""
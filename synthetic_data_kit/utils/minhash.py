@@ -0,0 +1,128 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# MinHash-LSH index for dropping near-duplicate QA pairs as they are generated
+import hashlib
+import random
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    """Character n-grams of text, lowercased with punctuation dropped and words space-separated
+
+    Character shingles are what keep short questions comparable: "of the
+    company" and "of this company" share most of theirs, where one changed
+    word removes two of a ten-word question's word pairs.
+    """
+    normalized = " " + " ".join(re.findall(r"\w+", text.lower())) + " "
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+# Words whose presence or absence rarely changes what a question asks; negations stay out
+_FUNCTION_WORDS = frozenset("""
+    a an the this that these those its it their there of in on at to for from by with as and or
+    is are was were be been being do does did has have had s
+""".split())
+
+
+def content_words(text: str) -> Set[str]:
+    """Lowercased words of text other than articles, prepositions and auxiliaries"""
+    return {word for word in re.findall(r"\w+", text.lower()) if word not in _FUNCTION_WORDS}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class NearDuplicateIndex:
+    """Incremental MinHash-LSH index over short texts
+
+    Each text's character shingles are MinHashed into bands * rows values and
+    every band is a bucket key, so a lookup only compares against texts
+    that share a bucket. Candidates are then checked with their exact
+    Jaccard similarity, so the banding only has to be generous enough not
+    to miss pairs at the threshold. A candidate also has to use exactly the
+    same content words: "increase" vs "decrease", "European" vs "Asian" or
+    "2021" vs "2022" differ by a few characters but are different
+    examples, while "of the company" and "of this company" are not. Safe
+    to share between threads.
+    """
+
+    def __init__(self, threshold: float = 0.9, bands: int = 16, rows: int = 4, shingle_size: int = 3, seed: int = 1):
+        """Initialize an empty index
+
+        Args:
+            threshold: Jaccard similarity at or above which a text is a near duplicate
+            bands: LSH bands (more bands find lower-similarity candidates)
+            rows: MinHash values per band
+            shingle_size: Characters per shingle
+            seed: Seed for the hash permutations
+        """
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._permutations = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(bands * rows)
+        ]
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(bands)]
+        self._shingles: List[Set[str]] = []
+        self._words: List[Set[str]] = []
+        self._lock = threading.Lock()
+
+    def _signature(self, items: Set[str]) -> List[int]:
+        hashes = [int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest(), 'little')
+                  for item in items] or [0]
+        return [min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in self._permutations]
+
+    def _band_keys(self, signature: List[int]) -> List[Tuple[int, ...]]:
+        return [tuple(signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def add(self, text: str) -> bool:
+        """Index text unless it nearly duplicates an indexed text
+
+        Returns:
+            True if text was new and has been added, False if it is a near duplicate
+        """
+        items = shingles(text, self.shingle_size)
+        words = content_words(text)
+        keys = self._band_keys(self._signature(items))
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(keys):
+                candidates.update(self._buckets[band].get(key, ()))
+            if any(
+                self._words[c] == words and jaccard(items, self._shingles[c]) >= self.threshold
+                for c in candidates
+            ):
+                return False
+            position = len(self._shingles)
+            self._shingles.append(items)
+            self._words.append(words)
+            for band, key in enumerate(keys):
+                self._buckets[band].setdefault(key, []).append(position)
+            return True
+
+    def __len__(self) -> int:
+        return len(self._shingles)
+
+    @classmethod
+    def from_config(cls, generation_config: Dict) -> Optional['NearDuplicateIndex']:
+        """Index per generation.near_duplicate_threshold, or None if the filter is off"""
+        threshold = generation_config.get("near_duplicate_threshold", 0.9)
+        if not threshold:
+            return None
+        return cls(threshold=threshold)
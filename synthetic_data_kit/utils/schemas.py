@@ -0,0 +1,65 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# JSON schemas for guided decoding, matching the shapes the parsers expect
+from typing import Dict, Any, List, Optional
+
+
+def _array_of(properties: Dict[str, Dict[str, Any]],
+              required: List[str],
+              min_items: Optional[int] = None,
+              max_items: Optional[int] = None) -> Dict[str, Any]:
+    schema = {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": properties,
+            "required": required,
+            "additionalProperties": False,
+        },
+    }
+    if min_items is not None:
+        schema["minItems"] = min_items
+    if max_items is not None:
+        schema["maxItems"] = max_items
+    return schema
+
+
+def qa_pairs_schema(max_items: Optional[int] = None) -> Dict[str, Any]:
+    """Array of {question, answer} objects, as read by parse_qa_pairs"""
+    return _array_of(
+        {"question": {"type": "string"}, "answer": {"type": "string"}},
+        ["question", "answer"],
+        min_items=1,
+        max_items=max_items,
+    )
+
+
+def ratings_schema(count: Optional[int] = None) -> Dict[str, Any]:
+    """Array of {question, answer, rating} objects, one per rated pair, as read by parse_ratings"""
+    return _array_of(
+        {
+            "question": {"type": "string"},
+            "answer": {"type": "string"},
+            "rating": {"type": "number", "minimum": 1, "maximum": 10},
+        },
+        ["question", "answer", "rating"],
+        min_items=count,
+        max_items=count,
+    )
+
+
+def cot_examples_schema(max_items: Optional[int] = None) -> Dict[str, Any]:
+    """Array of {question, reasoning, answer} objects, as read by COTGenerator"""
+    return _array_of(
+        {
+            "question": {"type": "string"},
+            "reasoning": {"type": "string"},
+            "answer": {"type": "string"},
+        },
+        ["question", "reasoning", "answer"],
+        min_items=1,
+        max_items=max_items,
+    )
@@ -0,0 +1,119 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the terms described in the LICENSE file in
+# the root directory of this source tree.
+# Token estimates for packing requests into submission waves
+import threading
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
+
+# Chat templates add a few tokens of role markers around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=4)
+def load_tokenizer(name: str):
+    """Load and cache a Hugging Face tokenizer, or None if transformers is unavailable"""
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        return None
+    try:
+        return AutoTokenizer.from_pretrained(name)
+    except Exception:
+        return None
+
+
+class TokenEstimator:
+    """Estimate prompt and completion tokens per request
+
+    Uses a local tokenizer when one is configured and loadable. Otherwise
+    falls back to a characters-per-token ratio that is calibrated against the
+    prompt token counts the server reports. Expected completion length is a
+    running average of observed completion tokens.
+    """
+
+    def __init__(self,
+                 tokenizer_name: Optional[str] = None,
+                 chars_per_token: float = 4.0,
+                 output_fraction: float = 0.25):
+        """Initialize the estimator
+
+        Args:
+            tokenizer_name: Hugging Face tokenizer to count with (optional)
+            chars_per_token: Initial ratio for the character heuristic
+            output_fraction: Share of max_tokens assumed for output before any is observed
+        """
+        self.tokenizer = load_tokenizer(tokenizer_name) if tokenizer_name else None
+        self.chars_per_token = chars_per_token
+        self.output_fraction = output_fraction
+        self._avg_output: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, vllm_config: Dict[str, Any]) -> 'TokenEstimator':
+        return cls(
+            tokenizer_name=vllm_config.get('tokenizer'),
+            chars_per_token=vllm_config.get('chars_per_token', 4.0),
+        )
+
+    def count(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return int(len(text) / self.chars_per_token) + 1
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count(m.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+    def expected_output(self, max_tokens: int) -> int:
+        if self._avg_output is None:
+            return int(max_tokens * self.output_fraction)
+        return min(max_tokens, int(self._avg_output))
+
+    def observe(self, messages: List[Dict[str, str]], usage: Dict[str, Any]):
+        """Calibrate against the usage block of a completed request"""
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        with self._lock:
+            if self.tokenizer is None and prompt_tokens:
+                overhead = MESSAGE_OVERHEAD_TOKENS * len(messages)
+                chars = sum(len(m.get("content") or "") for m in messages)
+                if prompt_tokens > overhead and chars:
+                    ratio = chars / (prompt_tokens - overhead)
+                    self.chars_per_token = 0.9 * self.chars_per_token + 0.1 * ratio
+            if completion_tokens is not None:
+                if self._avg_output is None:
+                    self._avg_output = float(completion_tokens)
+                else:
+                    self._avg_output = 0.9 * self._avg_output + 0.1 * completion_tokens
+
+
+def echo_max_tokens(tokens: TokenEstimator, message_batches: List[List[Dict[str, str]]], ceiling: int) -> int:
+    """max_tokens for requests whose reply restates their input, such as ratings echoing each pair
+
+    Twice the largest prompt leaves room for the added fields, and keeps a
+    short rating call from inheriting generation.max_tokens and the long
+    read timeout sized from it.
+    """
+    return min(ceiling, 2 * max(tokens.count_messages(messages) for messages in message_batches))
+
+
+def pack_waves(costs: List[int], token_budget: Optional[int], max_requests: int) -> List[List[int]]:
+    """Group consecutive request indices into waves under a token budget and a request cap
+
+    A request larger than the whole budget still gets a wave of its own.
+    """
+    waves = []
+    wave: List[int] = []
+    used = 0
+    for index, cost in enumerate(costs):
+        over_budget = token_budget is not None and wave and used + cost > token_budget
+        if len(wave) >= max_requests or over_budget:
+            waves.append(wave)
+            wave, used = [], 0
+        wave.append(index)
+        used += cost
+    if wave:
+        waves.append(wave)
+    return waves